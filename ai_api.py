@@ -1,157 +1,65 @@
 import aiohttp
+import asyncio
+import copy
+import hashlib
 import json
 import logging
-from logs import send_logs
-from typing import Dict, List, Optional
+import orjson
+import os
+import random
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
+from logs import send_logs, log_enabled
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
 
-class AIModelClient:
-    def __init__(self, api_key: str, api_url: str, model: str):
-        self.api_key = api_key
-        self.api_url = api_url.strip('"')  # Remove quotes if present
-        self.model = model.strip('"')  # Remove quotes if present
-        self.headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json",
-            "HTTP-Referer": "https://secondhand-market-bot.app",
-            "X-Title": "Second-Hand Market Bot",
-        }
-    
-    async def extract_product_attributes(self, product_name: str, category: str, 
-                                       subcategory: str, expected_attributes: List[str]) -> Dict:
-        """
-        Extract product attributes AND price suggestion using a generic AI model in a single call
-        """
-        try:
-            prompt = self._create_extraction_prompt(product_name, category, subcategory, expected_attributes)
-            
-            payload = {
-                "model": self.model,
-                "messages": [
-                    {
-                        "role": "system",
-                        "content": "You are a product information extraction expert. Your job is to analyze product names and extract detailed attributes. Always respond with valid JSON format containing the requested attributes. If you cannot determine an attribute, use 'Unknown' as the value. Be as accurate and detailed as possible based on the product name provided."
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                "temperature": 0.3,
-                "max_tokens": 1000,
-                "stream": False
-            }
-            
-            async with aiohttp.ClientSession() as session:
-                send_logs(f"Making API request to: {self.api_url}", 'info')
-                send_logs(f"Using model: {self.model}", 'info')
-                
-                async with session.post(self.api_url, headers=self.headers, json=payload) as response:
-                    send_logs(f"API Response Status: {response.status}", 'info')
-                    send_logs(f"API Response Headers: {dict(response.headers)}", 'info')
-                    
-                    if response.status == 200:
-                        try:
-                            result = await response.json()
-                            content = result.get('choices', [{}])[0].get('message', {}).get('content', '')
-                            
-                            if not content:
-                                send_logs("Empty content received from API", 'error')
-                                return {
-                                    'success': False,
-                                    'error': 'Empty response content from API',
-                                    'product_name': product_name
-                                }
-                            
-                            try:
-                                raw = content
-                                if '```json' in raw:
-                                    start = raw.find('```json') + len('```json')
-                                    end = raw.find('```', start)
-                                    if end != -1:
-                                        raw = raw[start:end].strip()
-                                else:
-                                    first_brace = raw.find('{')
-                                    last_brace = raw.rfind('}')
-                                    if first_brace != -1 and last_brace != -1 and last_brace > first_brace:
-                                        raw = raw[first_brace:last_brace+1]
-
-                                extracted_data = json.loads(raw)
-                                attributes = extracted_data.get('attributes', extracted_data)
-                                price_suggestion = extracted_data.get('price_suggestion', {})
-                                listing = extracted_data.get('listing', {})
-                                validated_data = self._validate_extracted_data(attributes, expected_attributes)
-                                
-                                send_logs(f"Successfully extracted attributes for: {product_name}", 'info')
-                                return {
-                                    'success': True,
-                                    'product_name': product_name,
-                                    'category': category,
-                                    'subcategory': subcategory,
-                                    'attributes': validated_data,
-                                    'confidence': self._calculate_confidence(validated_data),
-                                    'price_suggestion': price_suggestion,
-                                    'listing': listing
-                                }
-                                
-                            except json.JSONDecodeError as e:
-                                send_logs(f"Failed to parse JSON response: {e}", 'error')
-                                send_logs(f"Raw content: {content}", 'error')
-                                try:
-                                    manual_extraction = self._manual_attribute_extraction(raw if raw else content, expected_attributes)
-                                    return {
-                                        'success': True,
-                                        'product_name': product_name,
-                                        'category': category,
-                                        'subcategory': subcategory,
-                                        'attributes': manual_extraction,
-                                        'confidence': 0.5,
-                                        'note': 'Extracted using fallback method due to JSON parsing error'
-                                    }
-                                except Exception as me:
-                                    send_logs(f"Fallback manual extraction also failed: {me}", 'error')
-                                    return {
-                                        'success': False,
-                                        'error': f"JSON parse failed and fallback extraction failed: {e} | {me}",
-                                        'product_name': product_name
-                                    }
-                        except aiohttp.ContentTypeError as e:
-                            error_text = await response.text()
-                            send_logs(f"API returned non-JSON response: {e}", 'error')
-                            send_logs(f"Response text: {error_text[:500]}...", 'error')
-                            return {
-                                'success': False,
-                                'error': f"API returned HTML instead of JSON. Status: {response.status}. Response: {error_text[:200]}...",
-                                'product_name': product_name
-                            }
-                    else:
-                        error_text = await response.text()
-                        send_logs(f"API request failed with status {response.status}", 'error')
-                        send_logs(f"Error response: {error_text[:500]}...", 'error')
-                        return {
-                            'success': False,
-                            'error': f"API request failed: Status {response.status}. Response: {error_text[:200]}...",
-                            'product_name': product_name
-                        }
-        except Exception as e:
-            send_logs(f"Error extracting product attributes: {e}", 'error')
-            return {
-                'success': False,
-                'error': str(e),
-                'product_name': product_name
-            }
+# JSON object inside a ``` or ```json fenced block
+_FENCE_RE = re.compile(r'```(?:json)?\s*(\{.*?\})\s*```', re.DOTALL)
+_JSON_DECODER = json.JSONDecoder()
+# Lowercased placeholder answers the model uses for unknown attributes
+_EMPTY_VALUES = frozenset({'', 'n/a', 'not available', 'none', 'unknown'})
+# Default for dict lookups where None is a legitimate value
+_ABSENT = object()
+# Attribute values that count as "not extracted"
+_MISSING = frozenset({'_Not found_', 'Unknown', 'N/A', ''})
+# Unit markers that suggest a detailed technical value
+_TECH_INDICATORS = ('GB', 'MHz', 'inches', 'W', 'Hz', 'mAh', 'MP', 'dB', 'mm', 'kg')
+# Version numbers, capacities, frequencies, sizes, wattage and model tiers
+_SPECIFIC_RE = re.compile(r'v\d|\d+GB|\d+MHz|\d+"|\d+W|Pro|Max|Plus')
+# Lowercased key fragments of identifying attributes
+_CRITICAL_KEYS = ('brand', 'model', 'product type')
+# Statuses worth retrying: rate limiting and transient upstream failures
+_RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+_MAX_RETRY_DELAY = 30.0
+# Above this many attributes, validation + scoring runs off the event loop
+_THREAD_SCORING_THRESHOLD = 32
+# Part of every on-disk cache key; bump it when the prompts change to invalidate old answers
+PROMPT_VERSION = "v2"
+_DISK_CACHE_TTL = timedelta(days=7)
+# Tokens of a product name for cache keys: numbers, letter runs and '+' (so "S21+" != "S21");
+# other punctuation and number/unit spacing don't change which product is meant
+_NAME_TOKEN_RE = re.compile(r'\d+(?:[.,]\d+)?|[^\W\d_]+|\+')
 
-    def _create_extraction_prompt(self, product_name: str, category: str, 
-                                subcategory: str, expected_attributes: List[str]) -> str:
-        attributes_list = '", "'.join(expected_attributes)
-        prompt = f"""
-You are an expert product analyst with extensive knowledge of global consumer products, technical specifications, and market data. Your task is to extract accurate product attributes with 90%+ confidence.
+@lru_cache(maxsize=128)
+def _join_attributes(expected_attributes: Tuple[str, ...]) -> str:
+    """Attribute list as it appears in prompts; subcategories reuse the same few tuples"""
+    return '", "'.join(expected_attributes)
 
-PRODUCT TO ANALYZE:
-Name: "{product_name}"
-Category: {category}
-Subcategory: {subcategory}
+@lru_cache(maxsize=128)
+def _attribute_line_pattern(expected_attributes: Tuple[str, ...]) -> "re.Pattern":
+    """One alternation over all attribute names, matching `"Name": value` lines in a single scan"""
+    # Longest names first so "Model Year" isn't cut short by "Model"
+    names = '|'.join(re.escape(a) for a in sorted(expected_attributes, key=len, reverse=True))
+    return re.compile(r'^\s*["\']?(' + names + r')["\']?\s*:\s*(.+?)\s*,?\s*$', re.IGNORECASE | re.MULTILINE)
 
-REQUIRED ATTRIBUTES: [{attributes_list}]
+# Static instructions and examples for single-product extraction. Sent as the system message, so
+# every request shares the same prefix and providers with prompt caching can reuse it
+_EXTRACTION_SYSTEM_PROMPT = """
+You are an expert product analyst with extensive knowledge of global consumer products, technical specifications, and market data. Your task is to extract accurate product attributes with 90%+ confidence.
 
 ANALYSIS METHODOLOGY:
 1. BRAND IDENTIFICATION: Extract brand from product name using common patterns
@@ -202,7 +110,7 @@ CATEGORY EXPERTISE:
 EXAMPLES OF HIGH-QUALITY EXTRACTION:
 
 INPUT: "Apple iPhone 14 Pro Max 256GB Space Black"
-OUTPUT: {{
+OUTPUT: {
     "Brand": "Apple",
     "Model": "iPhone 14 Pro Max",
     "Operating System": "iOS 16",
@@ -213,10 +121,10 @@ OUTPUT: {{
     "Camera Specs": "48MP Pro camera system",
     "Battery Life": "Up to 29 hours video playback",
     "Connectivity (5G, Wi-Fi)": "5G, Wi-Fi 6"
-}}
+}
 
 INPUT: "Sony WH-1000XM4 Wireless Headphones"
-OUTPUT: {{
+OUTPUT: {
     "Product Type (Headphones, Speakers, TV)": "Headphones",
     "Brand": "Sony",
     "Model": "WH-1000XM4",
@@ -225,7 +133,7 @@ OUTPUT: {{
     "Wattage": "_Not found_",
     "Screen Resolution (TV)": "_Not found_",
     "Smart Features": "Active Noise Cancellation, Touch Controls, Google Assistant"
-}}
+}
 
 QUALITY REQUIREMENTS:
 ✅ Use EXACT attribute names from required list
@@ -235,8 +143,6 @@ QUALITY REQUIREMENTS:
 ✅ Ensure JSON is valid and complete
 ✅ Each required attribute must be present exactly once
 
-NOW ANALYZE: "{product_name}"
-
 Extract attributes with maximum accuracy using your product knowledge, pattern recognition, and logical inference. 
 
 ALSO include a price suggestion for the second-hand market based on:
@@ -251,118 +157,780 @@ ALSO generate a compelling marketplace listing:
 CRITICAL: You MUST provide ALL three sections: attributes, price_suggestion, AND listing.
 
 EXAMPLE OUTPUT for "MacBook Air M1 16GB 512GB":
-{{
-    "attributes": {{
+{
+    "attributes": {
         "Brand": "Apple",
         "Model": "MacBook Air M1",
         "RAM": "16GB",
         "Storage Capacity": "512GB",
         "Operating System": "macOS"
-    }},
-    "price_suggestion": {{
+    },
+    "price_suggestion": {
         "min_price": 800,
         "max_price": 1000,
         "currency": "USD",
         "reasoning": "MacBook Air M1 with 16GB RAM retains good value"
-    }},
-    "listing": {{
+    },
+    "listing": {
         "title": "Selling MacBook Air M1 16GB/512GB"
-    }}
-}}
+    }
+}
 
 Return ONLY a JSON object with this exact structure:
-{{
-    "attributes": {{
+{
+    "attributes": {
         // All required attributes here
-    }},
-    "price_suggestion": {{
+    },
+    "price_suggestion": {
         "min_price": <number>,
         "max_price": <number>, 
         "currency": "USD",
         "reasoning": "Brief explanation"
-    }},
-    "listing": {{
+    },
+    "listing": {
         "title": "Catchy listing title"
-    }}
+    }
+}
+"""
+
+# The only per-call part of a single-product extraction
+_EXTRACTION_USER_TMPL = """PRODUCT TO ANALYZE:
+Name: "{product_name}"
+Category: {category}
+Subcategory: {subcategory}
+
+REQUIRED ATTRIBUTES: ["{attributes_list}"]
+"""
+
+class _StreamError(Exception):
+    """Error frame received in the middle of a streamed completion"""
+
+class AIModelClient:
+    def __init__(self, api_key: str, api_url: str, model: str, max_concurrency: int = 16,
+                 cache_size: int = 1024, max_retries: int = 3, cache_dir: Optional[str] = "cache",
+                 json_retries: int = 2, disk_cache_max_files: int = 10000):
+        self.api_key = api_key
+        self.api_url = api_url.strip('"')  # Remove quotes if present
+        self.model = model.strip('"')  # Remove quotes if present
+        self.headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+            # Completions are text-heavy JSON; ask for a compressed body
+            "Accept-Encoding": "gzip, deflate",
+            "HTTP-Referer": "https://secondhand-market-bot.app",
+            "X-Title": "Second-Hand Market Bot",
+        }
+        # Constant parts of every completion request, built once per client
+        self._system_message = {
+            "role": "system",
+            "content": "You are a product information extraction expert. Your job is to analyze product names and extract detailed attributes. Always respond with valid JSON format containing the requested attributes. If you cannot determine an attribute, use 'Unknown' as the value. Be as accurate and detailed as possible based on the product name provided."
+        }
+        self._extraction_system_message = {
+            "role": "system",
+            "content": self._system_message["content"] + "\n" + _EXTRACTION_SYSTEM_PROMPT
+        }
+        self._payload_defaults = {
+            "model": self.model,
+            "temperature": 0.3,
+            "max_tokens": 1000,
+            "stream": True
+        }
+        # Shared HTTP session, created lazily inside the running event loop
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._session_lock = asyncio.Lock()
+        # Cap in-flight requests so bursts don't trip provider rate limits
+        self._sem = asyncio.Semaphore(max_concurrency)
+        # Extra attempts for rate-limited / transient server errors
+        self.max_retries = max_retries
+        # Times the model is shown its invalid JSON and asked again before the regex fallback
+        self.json_retries = json_retries
+        # LRU cache of successful extractions keyed by the request inputs
+        self._cache: "OrderedDict[tuple, Dict]" = OrderedDict()
+        self._cache_max = cache_size
+        # Parsed + validated form of raw model output, so repeated content skips re-parsing
+        self._parsed_cache: "OrderedDict[tuple, Dict]" = OrderedDict()
+        # Extractions also persist here (one file per request hash) so they survive restarts;
+        # None disables the disk cache
+        self.cache_dir = cache_dir
+        # Above this many entries the oldest are pruned, so the cache directory can't grow forever
+        self.disk_cache_max_files = disk_cache_max_files
+        self._disk_cache_lock = threading.Lock()
+        self._disk_cache_files = 0
+        # Write-through futures still running in the executor; close() waits for them
+        self._pending_cache_writes: Set[asyncio.Future] = set()
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            self._prune_disk_cache()
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """Return the shared ClientSession, creating it on first use"""
+        if self._session is not None and not self._session.closed:
+            return self._session
+        async with self._session_lock:
+            if self._session is None or self._session.closed:
+                connector = aiohttp.TCPConnector(
+                    limit=200,
+                    limit_per_host=50,
+                    keepalive_timeout=60,
+                    ttl_dns_cache=300,
+                    enable_cleanup_closed=True
+                )
+                self._session = aiohttp.ClientSession(
+                    connector=connector,
+                    headers=self.headers,
+                    # Bound connect and per-read stalls, plus a generous cap on the whole request:
+                    # SSE keep-alive comments reset sock_read, so only total stops a stuck generation
+                    timeout=aiohttp.ClientTimeout(total=180, sock_connect=10, sock_read=60),
+                    auto_decompress=True,
+                    raise_for_status=False
+                )
+            return self._session
+
+    async def close(self):
+        """Finish pending cache writes and close the shared HTTP session (call on shutdown)"""
+        if self._pending_cache_writes:
+            await asyncio.gather(*self._pending_cache_writes, return_exceptions=True)
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+    
+    async def extract_product_attributes(self, product_name: str, category: str, 
+                                       subcategory: str, expected_attributes: List[str]) -> Dict:
+        """
+        Extract product attributes AND price suggestion using a generic AI model in a single call
+        """
+        if not expected_attributes:
+            # Nothing to extract (unknown subcategory); don't spend an API call on it
+            return {
+                'success': True,
+                'product_name': product_name,
+                'category': category,
+                'subcategory': subcategory,
+                'attributes': {},
+                'confidence': 0.0,
+                'price_suggestion': {},
+                'listing': {}
+            }
+
+        key = self._cache_key(product_name, category, subcategory, expected_attributes)
+        cached = await self._cache_lookup(key, product_name)
+        if cached is not None:
+            send_logs(f"Cache hit for: {product_name}", 'info')
+            return cached
+
+        result = await self._request_extraction(product_name, category, subcategory, expected_attributes)
+        self._cache_put(key, result)
+        return result
+
+    async def extract_many(self, products: List[Tuple[str, str, str, List[str]]],
+                           batch_size: int = 5) -> List[Dict]:
+        """
+        Extract attributes for several products, packing up to batch_size products into one API call.
+        Results are returned in the same order as products.
+        """
+        results: List[Optional[Dict]] = [None] * len(products)
+        pending = []
+        for index, (product_name, category, subcategory, expected_attributes) in enumerate(products):
+            cached = await self._cache_lookup(
+                self._cache_key(product_name, category, subcategory, expected_attributes), product_name
+            )
+            if cached is not None:
+                results[index] = cached
+            else:
+                pending.append(index)
+
+        batches = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+        batch_results = await asyncio.gather(
+            *(self._request_batch([products[i] for i in batch]) for batch in batches)
+        )
+        for batch, batch_result in zip(batches, batch_results):
+            for index, result in zip(batch, batch_result):
+                results[index] = result
+        return results
+
+    async def _request_batch(self, products: List[Tuple[str, str, str, List[str]]]) -> List[Dict]:
+        """Extract a batch of products with one API call, retrying malformed items individually"""
+        if len(products) == 1:
+            return [await self.extract_product_attributes(*products[0])]
+
+        items = []
+        try:
+            content, error = await self._complete(self._create_batch_prompt(products),
+                                                  max_tokens=1000 * len(products))
+            if error is None:
+                items = self._load_json(content).get('results', [])
+                if not isinstance(items, list):
+                    send_logs(f"Batch extraction returned {type(items).__name__} results, "
+                              f"falling back to single calls", 'warning')
+                    items = []
+            else:
+                send_logs(f"Batch extraction failed, falling back to single calls: {error}", 'warning')
+        except Exception as e:
+            send_logs(f"Error parsing batch extraction response: {e}", 'error')
+
+        # Match answers to products by the number each one echoes, never by position in the reply;
+        # items without a valid, unique number go unmatched and those products are asked singly
+        by_number: Dict[int, Dict] = {}
+        duplicates = set()
+        for item in items:
+            if not isinstance(item, dict):
+                continue
+            number = item.get('index')
+            if isinstance(number, str) and number.strip().isdigit():
+                number = int(number)
+            if not isinstance(number, int) or isinstance(number, bool) or not 1 <= number <= len(products):
+                continue
+            if number in by_number:
+                duplicates.add(number)
+            by_number[number] = item
+        for number in duplicates:
+            del by_number[number]
+
+        results = []
+        for number, product in enumerate(products, 1):
+            product_name, category, subcategory, expected_attributes = product
+            item = by_number.get(number)
+            if item is not None:
+                try:
+                    result = {
+                        'success': True,
+                        'product_name': product_name,
+                        'category': category,
+                        'subcategory': subcategory,
+                        **(await self._build_parsed_async(item, expected_attributes))
+                    }
+                    self._cache_put(
+                        self._cache_key(product_name, category, subcategory, expected_attributes), result
+                    )
+                    results.append(result)
+                    continue
+                except Exception as e:
+                    send_logs(f"Malformed batch item for {product_name}: {e}", 'error')
+            results.append(await self.extract_product_attributes(*product))
+        return results
+
+    def _cache_key(self, product_name: str, category: str, subcategory: str,
+                   expected_attributes: List[str]) -> tuple:
+        # Case, spacing and punctuation don't change the answer: "iphone 13 pro, 256 gb"
+        # hits "iPhone 13 Pro 256GB"
+        normalized_name = ' '.join(_NAME_TOKEN_RE.findall(product_name.lower()))
+        return (normalized_name, category, subcategory, tuple(expected_attributes))
+
+    def _cache_get(self, key: tuple, product_name: str) -> Optional[Dict]:
+        cached = self._cache.get(key)
+        if cached is None:
+            return None
+        self._cache.move_to_end(key)
+        result = copy.deepcopy(cached)
+        # Echo the name as this caller typed it
+        result['product_name'] = product_name
+        return result
+
+    def _cache_put(self, key: tuple, result: Dict):
+        # Fallback extractions are lower quality; only cache clean parses
+        if result.get('success') and 'note' not in result:
+            self._cache[key] = copy.deepcopy(result)
+            if len(self._cache) > self._cache_max:
+                self._cache.popitem(last=False)
+            if self.cache_dir:
+                # Write-through in the default executor; only close() waits on it
+                future = asyncio.get_running_loop().run_in_executor(
+                    None, self._disk_cache_put, key, self._cache[key]
+                )
+                self._pending_cache_writes.add(future)
+                future.add_done_callback(self._pending_cache_writes.discard)
+
+    async def _cache_lookup(self, key: tuple, product_name: str) -> Optional[Dict]:
+        """Look a request up in memory, then on disk; disk hits are promoted into memory"""
+        cached = self._cache_get(key, product_name)
+        if cached is not None or not self.cache_dir:
+            return cached
+        result = await asyncio.to_thread(self._disk_cache_get, key)
+        if result is None:
+            return None
+        self._cache[key] = result
+        if len(self._cache) > self._cache_max:
+            self._cache.popitem(last=False)
+        return self._cache_get(key, product_name)
+
+    def _disk_cache_path(self, key: tuple) -> str:
+        # The model and prompt version are part of the hash, so switching either misses cleanly
+        digest = hashlib.sha256(orjson.dumps([PROMPT_VERSION, self.model, *key])).hexdigest()
+        return os.path.join(self.cache_dir, f"{digest}.json")
+
+    def _disk_cache_get(self, key: tuple) -> Optional[Dict]:
+        path = self._disk_cache_path(key)
+        try:
+            with open(path, 'rb') as f:
+                entry = orjson.loads(f.read())
+        except FileNotFoundError:
+            return None
+        except (OSError, orjson.JSONDecodeError) as e:
+            send_logs(f"Unreadable cache entry {path}: {e}", 'warning')
+            return None
+
+        response = entry.get('response')
+        expires_at = entry.get('expires_at')
+        if not isinstance(response, dict) or not expires_at:
+            return None
+        if expires_at < datetime.now().isoformat():
+            self._remove_cache_file(path)
+            return None
+        # Validated extractions always carry every expected attribute; anything else is stale
+        if not set(key[3]).issubset(response.get('attributes') or {}):
+            return None
+        return response
+
+    def _disk_cache_put(self, key: tuple, result: Dict):
+        path = self._disk_cache_path(key)
+        now = datetime.now()
+        entry = {
+            'response': result,
+            'created_at': now.isoformat(),
+            'expires_at': (now + _DISK_CACHE_TTL).isoformat()
+        }
+        # Write to a temp file and swap it in, so a reader never sees a half-written entry
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            encoded = orjson.dumps(entry)
+            with open(tmp_path, 'wb') as f:
+                f.write(encoded)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, orjson.JSONEncodeError) as e:
+            send_logs(f"Error writing cache entry {path}: {e}", 'error')
+            self._remove_cache_file(tmp_path)
+            return
+
+        with self._disk_cache_lock:
+            self._disk_cache_files += 1
+            over_cap = self._disk_cache_files > self.disk_cache_max_files
+        if over_cap:
+            self._prune_disk_cache()
+
+    def _prune_disk_cache(self):
+        """Delete expired and leftover temp entries, then the oldest ones beyond disk_cache_max_files"""
+        with self._disk_cache_lock:
+            try:
+                # Entries are never rewritten in place, so mtime is their creation time
+                expired_before = (datetime.now() - _DISK_CACHE_TTL).timestamp()
+                entries = []
+                with os.scandir(self.cache_dir) as it:
+                    for entry in it:
+                        if not entry.is_file():
+                            continue
+                        mtime = entry.stat().st_mtime
+                        if mtime < expired_before or (entry.name.endswith('.tmp') and mtime < time.time() - 60):
+                            self._remove_cache_file(entry.path)
+                        elif entry.name.endswith('.json'):
+                            entries.append((mtime, entry.path))
+
+                # Trim to 90% of the cap so a full cache isn't re-pruned on every write
+                if len(entries) > self.disk_cache_max_files:
+                    excess = len(entries) - int(self.disk_cache_max_files * 0.9)
+                    entries.sort()
+                    for _, path in entries[:excess]:
+                        self._remove_cache_file(path)
+                    entries = entries[excess:]
+                self._disk_cache_files = len(entries)
+            except OSError as e:
+                send_logs(f"Error pruning cache directory {self.cache_dir}: {e}", 'error')
+
+    @staticmethod
+    def _remove_cache_file(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    async def _complete(self, prompt: str, max_tokens: int = 1000, system_message: Optional[Dict] = None,
+                        followup: Optional[List[Dict]] = None) -> Tuple[Optional[str], Optional[str]]:
+        """Send a prompt (plus any follow-up turns) to the chat completions API. Returns (content, error)"""
+        messages = [system_message or self._system_message, {"role": "user", "content": prompt}]
+        if followup:
+            messages.extend(followup)
+        payload = {
+            **self._payload_defaults,
+            "messages": messages,
+            "max_tokens": max_tokens
+        }
+        
+        # Serialized once as bytes (the session already sends Content-Type: application/json)
+        # and reused across retries
+        body = orjson.dumps(payload)
+        
+        session = await self._get_session()
+        send_logs("Making API request to: %s", 'info', self.api_url)
+        send_logs("Using model: %s", 'info', self.model)
+        
+        for attempt in range(self.max_retries + 1):
+            async with self._sem:
+                async with session.post(self.api_url, data=body) as response:
+                    send_logs("API Response Status: %s", 'debug', response.status)
+                    if log_enabled('debug'):
+                        send_logs(f"API Response Headers: {dict(response.headers)}", 'debug')
+                    
+                    if response.ok:
+                        if response.content_type == 'text/event-stream':
+                            try:
+                                content = await self._read_stream(response)
+                            except _StreamError as e:
+                                # Text before the error is a cut-off answer; don't hand it to parsing
+                                return None, f"API stream error: {e}"
+                        else:
+                            # Provider ignored "stream"; parse the single JSON body
+                            raw = await response.read()
+                            try:
+                                result = orjson.loads(raw)
+                            except orjson.JSONDecodeError as e:
+                                error_text = raw[:500].decode('utf-8', 'replace')
+                                send_logs(f"API returned non-JSON response: {e}", 'error')
+                                send_logs(f"Response text: {error_text}...", 'error')
+                                return None, f"API returned HTML instead of JSON. Status: {response.status}. Response: {error_text[:200]}..."
+                            content = result.get('choices', [{}])[0].get('message', {}).get('content', '')
+                        if not content:
+                            send_logs("Empty content received from API", 'error')
+                            return None, 'Empty response content from API'
+                        return content, None
+                    
+                    # Read the error body once; this also lets the connection go back to the pool
+                    error_text = (await response.read())[:500].decode('utf-8', 'replace')
+                    if response.status not in _RETRY_STATUSES or attempt == self.max_retries:
+                        send_logs(f"API request failed with status {response.status}", 'error')
+                        send_logs(f"Error response: {error_text}...", 'error')
+                        return None, f"API request failed: Status {response.status}. Response: {error_text[:200]}..."
+                    delay = self._retry_delay(response.headers.get('Retry-After'), attempt)
+                    send_logs(f"API request got status {response.status}, retrying in {delay:.1f}s "
+                              f"(attempt {attempt + 1}/{self.max_retries})", 'warning')
+            # Back off outside the semaphore so waiting doesn't block other requests
+            await asyncio.sleep(delay)
+
+    def _retry_delay(self, retry_after: Optional[str], attempt: int) -> float:
+        """Seconds to wait before the next attempt, honoring Retry-After when present"""
+        if retry_after:
+            try:
+                delay = float(retry_after)
+            except ValueError:
+                try:
+                    delay = (parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds()
+                except (TypeError, ValueError):
+                    delay = None
+            if delay is not None:
+                return min(max(delay, 0.0) + random.random(), _MAX_RETRY_DELAY)
+        return min(2 ** attempt + random.random(), _MAX_RETRY_DELAY)
+
+    async def _read_stream(self, response: aiohttp.ClientResponse) -> str:
+        """Accumulate message content from a server-sent events completion stream.
+        
+        Raises _StreamError if the provider reports an error mid-stream.
+        """
+        parts = []
+        async for line in response.content:
+            line = line.strip()
+            # Skip blank separators and keep-alive comments
+            if not line.startswith(b'data:'):
+                continue
+            data = line[5:].strip()
+            if data == b'[DONE]':
+                break
+            try:
+                chunk = orjson.loads(data)
+            except orjson.JSONDecodeError:
+                send_logs(f"Skipping malformed stream frame: {data[:200]!r}", 'warning')
+                continue
+            if chunk.get('error'):
+                send_logs(f"API stream error: {chunk['error']}", 'error')
+                raise _StreamError(chunk['error'])
+            choices = chunk.get('choices') or [{}]
+            delta = choices[0].get('delta', {}).get('content')
+            if delta:
+                parts.append(delta)
+        return ''.join(parts)
+
+    async def _request_extraction(self, product_name: str, category: str,
+                                  subcategory: str, expected_attributes: List[str]) -> Dict:
+        """Call the AI model API and parse its answer into an extraction result"""
+        try:
+            prompt = self._create_extraction_prompt(product_name, category, subcategory, expected_attributes)
+            content, error = await self._complete(prompt, system_message=self._extraction_system_message)
+            if error is not None:
+                return {
+                    'success': False,
+                    'error': error,
+                    'product_name': product_name
+                }
+            
+            parsed = _ABSENT
+            followup: List[Dict] = []
+            for attempt in range(self.json_retries + 1):
+                try:
+                    parsed = await self._parse_content(content, expected_attributes)
+                    break
+                except json.JSONDecodeError as e:
+                    parse_error = e
+                    send_logs(f"Failed to parse JSON response: {e}", 'error')
+                    send_logs(f"Raw content: {content}", 'error')
+                    if attempt == self.json_retries:
+                        break
+                    # Show the model its own output and the parse error, and ask for the JSON alone
+                    followup += [
+                        {"role": "assistant", "content": content},
+                        {"role": "user", "content": f"Your output failed JSON parsing: {e.msg}. "
+                                                    f"Return only the JSON object."}
+                    ]
+                    await asyncio.sleep(1.0 * (attempt + 1))
+                    retry_content, error = await self._complete(
+                        prompt, system_message=self._extraction_system_message, followup=followup
+                    )
+                    if error is not None:
+                        send_logs(f"Retry after JSON parse failure failed: {error}", 'warning')
+                        break
+                    content = retry_content
+            
+            if parsed is not _ABSENT:
+                send_logs(f"Successfully extracted attributes for: {product_name}", 'info')
+                return {
+                    'success': True,
+                    'product_name': product_name,
+                    'category': category,
+                    'subcategory': subcategory,
+                    **copy.deepcopy(parsed)
+                }
+            
+            try:
+                manual_extraction = self._manual_attribute_extraction(content, expected_attributes)
+                if not manual_extraction:
+                    send_logs(f"Fallback extraction found no attributes for: {product_name}", 'error')
+                    return {
+                        'success': False,
+                        'error': f"JSON parse failed and no attributes could be extracted: {parse_error}",
+                        'product_name': product_name
+                    }
+                return {
+                    'success': True,
+                    'product_name': product_name,
+                    'category': category,
+                    'subcategory': subcategory,
+                    'attributes': manual_extraction,
+                    'confidence': 0.5,
+                    'note': 'Extracted using fallback method due to JSON parsing error'
+                }
+            except Exception as me:
+                send_logs(f"Fallback manual extraction also failed: {me}", 'error')
+                return {
+                    'success': False,
+                    'error': f"JSON parse failed and fallback extraction failed: {parse_error} | {me}",
+                    'product_name': product_name
+                }
+        except Exception as e:
+            send_logs(f"Error extracting product attributes: {e}", 'error')
+            return {
+                'success': False,
+                'error': str(e),
+                'product_name': product_name
+            }
+
+    def _load_json(self, content: str) -> Dict:
+        """Locate and decode the JSON object in model output"""
+        match = _FENCE_RE.search(content)
+        if match:
+            raw = match.group(1)
+        else:
+            first_brace = content.find('{')
+            raw = content[first_brace:] if first_brace != -1 else content
+
+        try:
+            return orjson.loads(raw)
+        except orjson.JSONDecodeError:
+            # Stops at the end of the first JSON object, ignoring trailing chatter;
+            # raises json.JSONDecodeError if the content still isn't valid JSON
+            obj, _ = _JSON_DECODER.raw_decode(raw)
+            return obj
+
+    def _manual_attribute_extraction(self, content: str, expected_attributes: List[str]) -> Dict:
+        """Fallback for output that isn't valid JSON: pick up `"Attribute": value` lines.
+        
+        Returns an empty dict when not one expected attribute could be found.
+        """
+        if not expected_attributes:
+            return {}
+        by_lower = {attr.lower(): attr for attr in expected_attributes}
+        found = {}
+        for match in _attribute_line_pattern(tuple(expected_attributes)).finditer(content):
+            attr = by_lower[match.group(1).lower()]
+            if attr not in found:
+                value = match.group(2).strip('"\'').strip()
+                found[attr] = value if value.lower() not in _EMPTY_VALUES else '_Not found_'
+        if not found:
+            return {}
+        return {attr: found.get(attr, '_Not found_') for attr in expected_attributes}
+
+    def _build_parsed(self, extracted_data: Dict, expected_attributes: List[str]) -> Dict:
+        """Validate one decoded extraction and score it"""
+        attributes = extracted_data.get('attributes', extracted_data)
+        validated_data = self._validate_extracted_data(attributes, expected_attributes)
+        return {
+            'attributes': validated_data,
+            'confidence': self._calculate_confidence(validated_data),
+            'price_suggestion': extracted_data.get('price_suggestion', {}),
+            'listing': extracted_data.get('listing', {})
+        }
+
+    async def _build_parsed_async(self, extracted_data: Dict, expected_attributes: List[str]) -> Dict:
+        """_build_parsed, moved to a worker thread for very large attribute sets"""
+        attributes = extracted_data.get('attributes', extracted_data)
+        if max(len(expected_attributes), len(attributes)) > _THREAD_SCORING_THRESHOLD:
+            return await asyncio.to_thread(self._build_parsed, extracted_data, expected_attributes)
+        return self._build_parsed(extracted_data, expected_attributes)
+
+    async def _parse_content(self, content: str, expected_attributes: List[str]) -> Dict:
+        """Parse model output into validated attributes, memoized on the raw content"""
+        key = (content, tuple(expected_attributes))
+        parsed = self._parsed_cache.get(key)
+        if parsed is not None:
+            self._parsed_cache.move_to_end(key)
+            return parsed
+
+        parsed = await self._build_parsed_async(self._load_json(content), expected_attributes)
+
+        self._parsed_cache[key] = parsed
+        if len(self._parsed_cache) > self._cache_max:
+            self._parsed_cache.popitem(last=False)
+        return parsed
+
+    def _create_batch_prompt(self, products: List[Tuple[str, str, str, List[str]]]) -> str:
+        numbered = []
+        for index, (product_name, category, subcategory, expected_attributes) in enumerate(products, 1):
+            attributes_list = _join_attributes(tuple(expected_attributes))
+            numbered.append(
+                f'{index}. Name: "{product_name}"\n'
+                f'   Category: {category} / {subcategory}\n'
+                f'   REQUIRED ATTRIBUTES: ["{attributes_list}"]'
+            )
+        products_text = '\n'.join(numbered)
+        return f"""
+Analyze each of the following {len(products)} products for the second-hand market.
+
+PRODUCTS:
+{products_text}
+
+For EACH product:
+- Set "index" to the product's number from the list above
+- Extract the required attributes using the EXACT attribute names; use "_Not found_" only when truly unable to determine
+- Include units and measurements (GB, MHz, inches, watts, etc.)
+- Suggest a second-hand price range in USD, assuming "good" condition
+- Write a catchy, concise listing title
+
+Return ONLY a JSON object with this exact structure, one entry per product:
+{{
+    "results": [
+        {{
+            "index": <product number>,
+            "attributes": {{
+                // All required attributes for this product
+            }},
+            "price_suggestion": {{
+                "min_price": <number>,
+                "max_price": <number>,
+                "currency": "USD",
+                "reasoning": "Brief explanation"
+            }},
+            "listing": {{
+                "title": "Catchy listing title"
+            }}
+        }}
+    ]
 }}
 """
-        return prompt
+
+    def _create_extraction_prompt(self, product_name: str, category: str, 
+                                subcategory: str, expected_attributes: List[str]) -> str:
+        return _EXTRACTION_USER_TMPL.format(
+            product_name=product_name,
+            category=category,
+            subcategory=subcategory,
+            attributes_list=_join_attributes(tuple(expected_attributes))
+        )
 
     def _validate_extracted_data(self, data: Dict, expected_attributes: List[str]) -> Dict:
         validated = {}
+        seen_values = set()
         for attr in expected_attributes:
-            if attr in data:
-                value = data[attr]
+            value = data.get(attr, _ABSENT)  # one hash lookup instead of `in` + indexing
+            if value is not _ABSENT:
                 if isinstance(value, str):
                     value = value.strip()
-                    if value.lower() in ['', 'n/a', 'not available', 'none', 'unknown']:
+                    if value.lower() in _EMPTY_VALUES:
                         value = '_Not found_'
+                    seen_values.add(value)
                 validated[attr] = value
             else:
                 validated[attr] = '_Not found_'
+                seen_values.add('_Not found_')
+        # Keep extra string attributes unless they just repeat an existing value
         for key, value in data.items():
-            if key not in validated:
-                if isinstance(value, str):
-                    value = value.strip()
-                    existing_values = list(validated.values())
-                    if value not in existing_values or value == '_Not found_':
-                        validated[key] = value
+            if key not in validated and isinstance(value, str):
+                value = value.strip()
+                if value not in seen_values or value == '_Not found_':
+                    validated[key] = value
+                    seen_values.add(value)
         return validated
 
     def _calculate_confidence(self, attributes: Dict) -> float:
         total_attrs = len(attributes)
-        not_found_attrs = sum(1 for v in attributes.values() if str(v) in ['_Not found_', 'Unknown', 'N/A', ''])
         if total_attrs == 0:
             return 0.0
+        not_found_attrs = 0
+        detailed_attrs = 0
+        specific_count = 0
+        # One pass over the attributes; str(v) and its lowercase form are computed once per value
+        lowered_texts = []
+        critical_keys = set()
+        brand_value = None
+        for k, v in attributes.items():
+            text = str(v)
+            lowered_text = text.lower()
+            lowered_texts.append(lowered_text)
+            if text in _MISSING:
+                not_found_attrs += 1
+            else:
+                lowered_key = k.lower()
+                for target in _CRITICAL_KEYS:
+                    if target in lowered_key:
+                        critical_keys.add(target)
+                if brand_value is None and 'brand' in lowered_key:
+                    brand_value = lowered_text
+            if any(indicator in text for indicator in _TECH_INDICATORS):
+                detailed_attrs += 1
+            if _SPECIFIC_RE.search(text):
+                specific_count += 1
         found_attrs = total_attrs - not_found_attrs
         base_confidence = found_attrs / total_attrs
         confidence_boosters = 0.0
-        critical_attrs = ['Brand', 'Model', 'Product Type']
-        critical_found = 0
-        for attr in critical_attrs:
-            for k, v in attributes.items():
-                if any(crit.lower() in k.lower() for crit in [attr]) and str(v) not in ['_Not found_', 'Unknown', 'N/A', '']:
-                    critical_found += 1
-                    break
+        critical_found = len(critical_keys)
         if critical_found >= 3:
             confidence_boosters += 0.30
         elif critical_found >= 2:
             confidence_boosters += 0.20
         elif critical_found >= 1:
             confidence_boosters += 0.10
-        technical_indicators = ['GB', 'MHz', 'inches', 'W', 'Hz', 'mAh', 'MP', 'dB', 'mm', 'kg']
-        detailed_attrs = 0
-        for v in attributes.values():
-            if any(indicator in str(v) for indicator in technical_indicators):
-                detailed_attrs += 1
         if detailed_attrs >= 3:
             confidence_boosters += 0.20
         elif detailed_attrs >= 2:
             confidence_boosters += 0.15
         elif detailed_attrs >= 1:
             confidence_boosters += 0.10
-        specific_patterns = ['v[0-9]', '[0-9]+GB', '[0-9]+MHz', '[0-9]+"', '[0-9]+W', 'Pro', 'Max', 'Plus']
-        specific_count = 0
-        for v in attributes.values():
-            if any(pattern.replace('[0-9]', '\\d') in str(v) for pattern in specific_patterns):
-                specific_count += 1
         if specific_count >= 2:
             confidence_boosters += 0.15
         elif specific_count >= 1:
             confidence_boosters += 0.10
-        brand_value = None
-        for k, v in attributes.items():
-            if 'brand' in k.lower() and str(v) not in ['_Not found_', 'Unknown', 'N/A', '']:
-                brand_value = str(v).lower()
-                break
         if brand_value:
-            consistent_mentions = sum(1 for v in attributes.values() if brand_value in str(v).lower())
+            # The brand may come after other values, so this count can't join the pass above
+            consistent_mentions = sum(1 for text in lowered_texts if brand_value in text)
             if consistent_mentions >= 2:
                 confidence_boosters += 0.10
-        completeness_ratio = found_attrs / total_attrs
-        if completeness_ratio >= 0.9:
+        if base_confidence >= 0.9:
             confidence_boosters += 0.05
-        elif completeness_ratio >= 0.8:
+        elif base_confidence >= 0.8:
             confidence_boosters += 0.03
         final_confidence = min(base_confidence + confidence_boosters, 1.0)
         if critical_found >= 2 and found_attrs >= (total_attrs * 0.6):
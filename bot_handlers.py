@@ -1,573 +1,879 @@
 from telethon import events
+from telethon.errors import FloodWaitError
+from telethon.extensions import markdown
 from telethon.tl.custom import Button
+import asyncio
+import functools
+import os
 import logging
 from logs import send_logs
-from typing import List, Dict
+from typing import List, Dict, Optional, Set, Tuple
+from collections import OrderedDict
 from session_manager import SessionManager, ConversationState
 from ai_api import AIModelClient
 from json_storage import JSONStorage
 from listing_exporter import ListingExporter
 import re
+import time
+
+# Number-like run in a price message, e.g. "299.99" in "299.99 lei"
+_PRICE_RE = re.compile(r'[\d.,]+')
+# Quiet period before a (possibly multi-message) product name is sent for analysis
+_PRODUCT_DEBOUNCE_SECONDS = 0.3
+# Placeholder attribute values that are left out of the final listing
+_MISSING_ATTR_VALUES = ('Unknown', '_Not found_')
+# Most completed listings written to export files in one worker-thread trip
+_EXPORT_BATCH_MAX = 32
+# Confidence indicator, indexed by how many of the 0.4 / 0.7 thresholds are met
+_CONF_EMOJI = ("🔴", "🟡", "🟢")
+# Minimum interval between /plaseaza_anunt commands from the same user
+_START_COOLDOWN_SECONDS = 2.0
+# Characters that can start Markdown entities (bold, italic, code, links, strike)
+_MARKDOWN_CHARS = frozenset('*_`[~')
+
+def _price_range(price_suggestion) -> Optional[str]:
+    """'$min - $max' from an AI price suggestion, or None when it has no usable maximum"""
+    if not isinstance(price_suggestion, dict):
+        return None
+    def number(key):
+        # The model may send null, a string or nothing at all
+        try:
+            return float(price_suggestion.get(key))
+        except (TypeError, ValueError):
+            return None
+    max_price = number('max_price')
+    if max_price is None or max_price <= 0:
+        return None
+    min_price = number('min_price')
+    if min_price is None or min_price < 0 or min_price > max_price:
+        return f"up to ${max_price:.0f}"
+    return f"${min_price:.0f} - ${max_price:.0f}"
+
+def _parse_mode(text: str) -> Optional[str]:
+    """'Markdown' if text has formatting characters, else None to skip the parser entirely"""
+    return 'Markdown' if not _MARKDOWN_CHARS.isdisjoint(text) else None
+
+def _handler(log_msg: str, user_msg: str, answer: bool = False):
+    """Wrap a handle_* coroutine: log failures and tell the user, via event.answer for callbacks"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(self, event, *args, **kwargs):
+            try:
+                return await func(self, event, *args, **kwargs)
+            except FloodWaitError as e:
+                # Any reply would hit the same flood limit; just record it
+                send_logs("Flood wait of %ss in %s", 'warning', e.seconds, func.__name__)
+            except Exception as e:
+                send_logs(log_msg, 'error', e, exc_info=True)
+                if answer:
+                    await event.answer(user_msg)
+                else:
+                    await self._respond(event, user_msg)
+        return wrapper
+    return decorator
 
 class BotHandlers:
+    # Static replies and keyboards, built once and shared by every handler call
+    _CANCEL_BUTTON = Button.inline("❌ Cancel", "cancel_listing")
+    _CANCEL_KB = [[_CANCEL_BUTTON]]
+    _CONFIRM_KB = [
+        [
+            Button.inline("✅ Yes, Continue", "confirm_product"),
+            Button.inline("❌ No, Try Again", "reject_product")
+        ],
+        [Button.inline("🚫 Cancel Listing", "cancel_listing")]
+    ]
+    _CATEGORY_PROMPT = (
+        "🏪 **Create New Listing**\n\n"
+        "Please select a category for your product:"
+    )
+    _SUBCATEGORY_PROMPT_TMPL = (
+        "📁 **Category:** {category}\n\n"
+        "Please select a subcategory:"
+    )
+    _PRODUCT_INPUT_TMPL = (
+        "📁 **Category:** {category}\n"
+        "📂 **Subcategory:** {subcategory}\n\n"
+        "🏷️ Please enter the product name/model:\n"
+        "*(Be as specific as possible, e.g., \"iPhone 13 Pro Max 256GB\")*"
+    )
+    _PRODUCT_RETRY_TMPL = (
+        "📁 **Category:** {category}\n"
+        "📂 **Subcategory:** {subcategory}\n\n"
+        "Please enter the product name again (be more specific):"
+    )
+    _PROCESSING_TMPL = (
+        "🔍 **Analyzing product...**\n\n"
+        "📁 Category: {category}\n"
+        "📂 Subcategory: {subcategory}\n"
+        "🏷️ Product: {product}\n\n"
+        "⏳ Please wait while I extract product information..."
+    )
+    # Description removed from both listing displays
+    _CONFIRMATION_TMPL = (
+        "🎯 **Complete Listing Generated**\n\n"
+        "📝 **Title:** {title}\n\n"
+        " **Product Details:**\n"
+        "🏷️ **Product:** {product}\n"
+        "📁 **Category:** {category}\n"
+        "📂 **Subcategory:** {subcategory}\n"
+        "{confidence_emoji} **Confidence:** {confidence:.0f}%\n\n"
+        "{price_text}"
+        "� **Attributes:**\n{attr_text}\n"
+        "Is this listing information correct?"
+    )
+    _LISTING_CREATED_TMPL = (
+        "🎉 **Listing Created Successfully!**\n\n"
+        "🆔 **Listing ID:** #{product_id}\n\n"
+        "📝 **Your Listing:**\n"
+        "**Title:** {title}\n\n"
+        "📊 **Details:**\n"
+        "🏷️ **Product:** {product}\n"
+        "📁 **Category:** {category}\n"
+        "📂 **Subcategory:** {subcategory}\n"
+        "💰 **Price:** ${price:.2f}\n\n"
+        "🔧 **Product Attributes:**\n{attr_text}\n"
+        "✅ **Saved to database!**\n"
+    )
+    _CANCELLED_MSG = (
+        "🚫 **Listing Cancelled**\n\n"
+        "Your listing session has been cancelled. "
+        "You can start a new one anytime with /plaseaza_anunt."
+    )
+    _NO_SESSION_TO_CANCEL_MSG = "ℹ️ No active listing session to cancel."
+    _NO_ACTIVE_SESSION_MSG = "ℹ️ No active listing session. Use /plaseaza_anunt to start one!"
+    _BUSY_MSG = "⏳ Still analyzing your previous product, please wait..."
+    _SLOW_DOWN_MSG = "⏳ Please wait a moment before starting another listing."
+    _SAVING_MSG = "💾 Saving your listing..."
+    # Static Markdown replies parsed once into (plain text, entities)
+    _PREPARSED = {text: markdown.parse(text) for text in (_CATEGORY_PROMPT, _CANCELLED_MSG)}
+    
     def __init__(self, storage: JSONStorage, ai_client: AIModelClient, session_manager: SessionManager):
         self.storage = storage
         self.deepseek_api = ai_client
         self.session_manager = session_manager
         self.exporter = ListingExporter()
+        # user_id -> (buffered product-name messages, pending flush task)
+        self._pending_product: Dict[int, Tuple[List[str], asyncio.Task]] = {}
+        # Flush tasks past their debounce wait; held here so they aren't dropped mid-run
+        self._flush_tasks: Set[asyncio.Task] = set()
+        # Users with an extraction in flight
+        self._extracting = set()
+        # Users whose listing is currently being written to storage
+        self._saving = set()
+        # user_id -> time of their last /plaseaza_anunt, oldest first; only entries still inside
+        # the cooldown are kept
+        self._last_start: "OrderedDict[int, float]" = OrderedDict()
+        # Fixed callback payloads -> handler(event, user_id); "c:"/"s:" ids are parsed separately
+        self._cb_actions = {
+            b"back_to_categories": self._on_back_to_categories,
+            b"cancel_listing": self.cancel_listing,
+            b"confirm_product": self._on_confirm_product,
+            b"reject_product": self._on_reject_product
+        }
+        # (chat_id, message_id) -> [queued (text, kwargs) or None, future of the last edit]
+        self._pending_edits: Dict[Tuple, list] = {}
+        # (extracted_data, user_id, product_id, event) waiting to be exported; the worker
+        # task is started on first use since there is no running loop yet
+        self._export_queue: "asyncio.Queue[Tuple]" = asyncio.Queue()
+        self._export_worker: Optional[asyncio.Task] = None
+        # Conversation state value -> handler for free-text messages, called with
+        # (event, user_id, session, text); the session is fetched once per message
+        self._text_dispatch = {
+            ConversationState.PRODUCT_INPUT.value: self._queue_product_name,
+            ConversationState.PRICE_INPUT.value: self.process_price_input
+        }
+        self.refresh_categories()
+    
+    def refresh_categories(self):
+        """Snapshot the categories and rebuild the indexes and keyboards derived from them.
+        
+        Categories don't change at runtime, so this runs once at startup; call it again
+        after the session manager's categories are reloaded.
+        """
+        self._categories = tuple(self.session_manager.get_categories())
+        # Indexed by lowercased name
+        self._cat_index = {cat["category"].lower(): cat for cat in self._categories}
+        # Callback data carries small ids ("c:0", "s:3") instead of names: unambiguous
+        # and well under Telegram's 64-byte limit
+        self._subcat_by_id = [
+            (cat["category"], subcat["name"])
+            for cat in self._categories for subcat in cat["subcategories"]
+        ]
+        self._subcat_ids = {pair: idx for idx, pair in enumerate(self._subcat_by_id)}
+        # Inline keyboards are the same for every user, so build them once
+        self._category_kb = self._build_category_keyboard()
+        self._subcategory_kb_cache = {
+            cat["category"]: self._build_subcategory_keyboard(cat) for cat in self._categories
+        }
+    
+    def _build_category_keyboard(self) -> List[List]:
+        """Category buttons (2 per row) followed by a cancel button"""
+        categories = self._categories
+        buttons = []
+        for i in range(0, len(categories), 2):
+            row = []
+            for j in range(i, min(i + 2, len(categories))):
+                cat_name = categories[j]["category"]
+                row.append(Button.inline(
+                    text=f"📁 {cat_name}",
+                    data=f"c:{j}"
+                ))
+            buttons.append(row)
+        
+        # Add cancel button
+        buttons.append([self._CANCEL_BUTTON])
+        return buttons
+    
+    def _build_subcategory_keyboard(self, category: Dict) -> List[List]:
+        """Subcategory buttons for one category, plus back and cancel buttons"""
+        category_name = category["category"]
+        buttons = []
+        for subcat in category["subcategories"]:
+            subcat_name = subcat["name"]
+            buttons.append([Button.inline(
+                text=f"📂 {subcat_name}",
+                data=f"s:{self._subcat_ids[(category_name, subcat_name)]}"
+            )])
+        
+        # Add back and cancel buttons
+        buttons.append([
+            Button.inline("🔙 Back to Categories", "back_to_categories"),
+            self._CANCEL_BUTTON
+        ])
+        return buttons
     
-    async def _get_user_info(self, event):
+    def _format_kwargs(self, text: str, kwargs: Dict) -> str:
+        """Pick pre-parsed entities or a parse mode for text; returns the text to send"""
+        parsed = self._PREPARSED.get(text)
+        if parsed is not None:
+            text, kwargs['formatting_entities'] = parsed
+        else:
+            kwargs.setdefault('parse_mode', _parse_mode(text))
+        return text
+    
+    async def _respond(self, event, text: str, **kwargs):
+        """event.respond, parsing Markdown only when the text can contain any"""
+        text = self._format_kwargs(text, kwargs)
+        return await event.respond(text, **kwargs)
+    
+    async def _edit(self, target, text: str, **kwargs):
+        """target.edit, parsing Markdown only when the text can contain any.
+        
+        Edits to the same message are serialized and coalesced: while one is in flight,
+        later edits only replace the queued payload, so just the newest one is sent.
+        """
+        text = self._format_kwargs(text, kwargs)
+        # Callback events carry the message in message_id; Message objects use id
+        message_id = getattr(target, 'message_id', None) or target.id
+        key = (target.chat_id, message_id)
+        slot = self._pending_edits.get(key)
+        if slot is not None:
+            slot[0] = (text, kwargs)
+            return await asyncio.shield(slot[1])
+        
+        done = asyncio.get_running_loop().create_future()
+        slot = self._pending_edits[key] = [(text, kwargs), done]
+        result = None
+        try:
+            while slot[0] is not None:
+                queued_text, queued_kwargs = slot[0]
+                slot[0] = None
+                result = await target.edit(queued_text, **queued_kwargs)
+        except asyncio.CancelledError:
+            done.cancel()
+            raise
+        except Exception as e:
+            done.set_exception(e)
+            done.exception()  # Retrieved here; waiters re-raise it themselves
+            raise
+        else:
+            done.set_result(result)
+        finally:
+            del self._pending_edits[key]
+        return result
+    
+    async def get_user_info(self, event):
         """Helper method to get user info from event"""
+        user_id = event.sender_id
+        # Not cached across updates, so a renamed account is saved under its current username.
+        # Telethon resolves the sender from the update's own entities; this rarely costs an RPC.
         sender = await event.get_sender()
-        return sender.id, sender.username or f"User_{sender.id}"
+        username = sender.username or f"User_{sender.id}"
+        return user_id, username
     
     def register_handlers(self, client):
         """Register all bot event handlers"""
+        # Commands are dispatched by their first token; /start and /help live in script.py
+        self._cmd_table = {
+            '/plaseaza_anunt': self.handle_plaseaza_anunt,
+            '/cancel': self.handle_cancel_command,
+            '/status': self.handle_status_command,
+            '/my_listings': self.handle_my_listings_command
+        }
         
-        @client.on(events.NewMessage(func=lambda e: e.text and e.text.lower().startswith('/plaseaza_anunt')))
-        async def plaseaza_anunt_command(event):
-            await self.handle_plaseaza_anunt(event)
+        @client.on(events.NewMessage())
+        async def message_handler(event):
+            text = event.raw_text  # plain text; .text would re-render entities as Markdown
+            if not text:
+                return
+            if text[0] == '/':
+                # "/Status@SomeBot args" -> "/status"
+                command = text.split(maxsplit=1)[0].partition('@')[0].lower()
+                handler = self._cmd_table.get(command)
+                if handler:
+                    await handler(event)
+            elif not text.isspace() and self.session_manager.is_session_active(event.sender_id):
+                await self.handle_text_message(event)
         
         @client.on(events.CallbackQuery())
         async def callback_handler(event):
             await self.handle_callback_query(event)
-        
-        @client.on(events.NewMessage(func=lambda e: e.text and not e.text.startswith('/') and e.text.strip() != ''))
-        async def text_message_handler(event):
-            await self.handle_text_message(event)
-        
-        @client.on(events.NewMessage(func=lambda e: e.text and e.text.lower().startswith('/cancel')))
-        async def cancel_command(event):
-            await self.handle_cancel_command(event)
-        
-        @client.on(events.NewMessage(func=lambda e: e.text and e.text.lower().startswith('/status')))
-        async def status_command(event):
-            await self.handle_status_command(event)
-        
-        @client.on(events.NewMessage(func=lambda e: e.text and e.text.lower().startswith('/my_listings')))
-        async def my_listings_command(event):
-            await self.handle_my_listings_command(event)
     
+    @_handler("Error in plaseaza_anunt command: %s", "❌ An error occurred. Please try again later.")
     async def handle_plaseaza_anunt(self, event):
         """Handle the /plaseaza_anunt command"""
-        try:
-            sender = await event.get_sender()
-            user_id = sender.id
-            
-            # Check if user already has an active session
-            if self.session_manager.is_session_active(user_id):
-                summary = self.session_manager.get_session_summary(user_id)
-                await event.respond(
-                    f"❗ You already have an active listing session!\n\n{summary}\n\n"
-                    f"Use /cancel to cancel current session or /status to see current progress.",
-                    parse_mode="Markdown"
-                )
-                return
-            
-            # Start new listing session
-            if self.session_manager.start_new_session(user_id):
-                await self.show_category_selection(event)
-            else:
-                await event.respond("❌ Failed to start listing session. Please try again.")
-                
-        except Exception as e:
-            send_logs(f"Error in plaseaza_anunt command: {e}", 'error')
-            await event.respond("❌ An error occurred. Please try again later.")
+        user_id = event.sender_id
+        
+        # Anti-flood: ignore repeated /plaseaza_anunt within a short window
+        now = time.monotonic()
+        if now - self._last_start.get(user_id, 0.0) < _START_COOLDOWN_SECONDS:
+            await self._respond(event, self._SLOW_DOWN_MSG)
+            return
+        self._last_start[user_id] = now
+        self._last_start.move_to_end(user_id)
+        # Drop users whose cooldown has run out; the newest entry (this one) always stays
+        while now - next(iter(self._last_start.values())) >= _START_COOLDOWN_SECONDS:
+            self._last_start.popitem(last=False)
+        
+        # Build exactly one reply (text + keyboard) for whichever branch applies
+        buttons = None
+        if self.session_manager.is_session_active(user_id):
+            summary = self.session_manager.get_session_summary(user_id)
+            text = (
+                f"❗ You already have an active listing session!\n\n{summary}\n\n"
+                f"Use /cancel to cancel current session or /status to see current progress."
+            )
+        elif not self._categories:
+            text = "❌ No categories available. Please contact administrator."
+        elif await asyncio.to_thread(self.session_manager.start_new_session, user_id):
+            text, buttons = self._CATEGORY_PROMPT, self._category_kb
+        else:
+            text = "❌ Failed to start listing session. Please try again."
+        
+        await self._respond(event, text, buttons=buttons)
     
     async def show_category_selection(self, event):
         """Show category selection inline keyboard"""
         try:
-            categories = self.session_manager.get_categories()
-            
-            if not categories:
-                await event.respond("❌ No categories available. Please contact administrator.")
+            if not self._categories:
+                await self._respond(event, "❌ No categories available. Please contact administrator.")
                 return
             
-            # Create inline keyboard with categories (2 per row)
-            buttons = []
-            for i in range(0, len(categories), 2):
-                row = []
-                for j in range(i, min(i + 2, len(categories))):
-                    cat_name = categories[j]["category"]
-                    row.append(Button.inline(
-                        text=f"📁 {cat_name}",
-                        data=f"cat_{cat_name}"
-                    ))
-                buttons.append(row)
-            
-            # Add cancel button
-            buttons.append([Button.inline("❌ Cancel", "cancel_listing")])
-            
-            await event.respond(
-                "🏪 **Create New Listing**\n\n"
-                "Please select a category for your product:",
-                buttons=buttons,
-                parse_mode="Markdown"
+            await self._respond(
+                event,
+                self._CATEGORY_PROMPT,
+                buttons=self._category_kb
             )
             
         except Exception as e:
-            send_logs(f"Error showing category selection: {e}", 'error')
-            await event.respond("❌ Error displaying categories. Please try again.")
+            send_logs("Error showing category selection: %s", 'error', e, exc_info=True)
+            await self._respond(event, "❌ Error displaying categories. Please try again.")
     
     async def show_subcategory_selection(self, event, category_name: str):
         """Show subcategory selection for the chosen category"""
         try:
-            category = self.session_manager.get_category_by_name(category_name)
+            category = self._cat_index.get(category_name.lower())
             if not category:
-                await event.respond("❌ Invalid category. Please try again.")
+                await self._respond(event, "❌ Invalid category. Please try again.")
                 return
             
-            subcategories = category["subcategories"]
-            
-            # Create inline keyboard with subcategories
-            buttons = []
-            for subcat in subcategories:
-                subcat_name = subcat["name"]
-                buttons.append([Button.inline(
-                    text=f"📂 {subcat_name}",
-                    data=f"subcat_{category_name}_{subcat_name}"
-                )])
-            
-            # Add back and cancel buttons
-            buttons.append([
-                Button.inline("🔙 Back to Categories", "back_to_categories"),
-                Button.inline("❌ Cancel", "cancel_listing")
-            ])
+            buttons = self._subcategory_kb_cache[category["category"]]
             
-            await event.edit(
-                f"📁 **Category:** {category_name}\n\n"
-                f"Please select a subcategory:",
-                buttons=buttons,
-                parse_mode="Markdown"
+            await self._edit(
+                event,
+                self._SUBCATEGORY_PROMPT_TMPL.format(category=category_name),
+                buttons=buttons
             )
             
         except Exception as e:
-            send_logs(f"Error showing subcategory selection: {e}", 'error')
-            await event.respond("❌ Error displaying subcategories. Please try again.")
+            send_logs("Error showing subcategory selection: %s", 'error', e, exc_info=True)
+            await self._respond(event, "❌ Error displaying subcategories. Please try again.")
     
+    @_handler("Error handling callback query: %s", "❌ An error occurred. Please try again.", answer=True)
     async def handle_callback_query(self, event):
         """Handle inline keyboard button presses"""
-        try:
-            data = event.data.decode('utf-8')
-            sender = await event.get_sender()
-            user_id = sender.id
-            
-            if data.startswith("cat_"):
-                # Category selection
-                category_name = data[4:]  # Remove "cat_" prefix
-                
-                if self.session_manager.set_category(user_id, category_name):
-                    await self.show_subcategory_selection(event, category_name)
-                else:
-                    await event.answer("❌ Error selecting category. Please try again.")
-            
-            elif data.startswith("subcat_"):
-                # Subcategory selection
-                parts = data[7:].split("_", 1)  # Remove "subcat_" prefix
-                if len(parts) == 2:
-                    category_name, subcategory_name = parts
-                    
-                    if self.session_manager.set_subcategory(user_id, subcategory_name):
-                        await self.request_product_name(event, category_name, subcategory_name)
-                    else:
-                        await event.answer("❌ Error selecting subcategory. Please try again.")
-            
-            elif data == "back_to_categories":
-                # Go back to category selection
-                session = self.session_manager.get_session_state(user_id)
-                if session:
-                    self.session_manager.update_session_state(user_id, ConversationState.CATEGORY_SELECTION)
-                    await self.show_category_selection(event)
-            
-            elif data == "cancel_listing":
-                # Cancel listing
-                await self.cancel_listing(event, user_id)
-            
-            elif data == "confirm_product":
-                # User confirmed the extracted product data, now ask for price
-                await self.request_price(event, user_id)
-            
-            elif data == "reject_product":
-                # User rejected the extracted data, ask for product name again
-                session = self.session_manager.get_session_state(user_id)
-                if session:
-                    self.session_manager.update_session_state(user_id, ConversationState.PRODUCT_INPUT)
-                    await event.edit(
-                        f"📁 **Category:** {session['category']}\n"
-                        f"📂 **Subcategory:** {session['subcategory']}\n\n"
-                        f"Please enter the product name again (be more specific):",
-                        buttons=[[Button.inline("❌ Cancel", "cancel_listing")]],
-                        parse_mode="Markdown"
-                    )
+        data = event.data  # raw bytes; ids parse straight from bytes, no decode needed
+        user_id = event.sender_id
+        
+        action = self._cb_actions.get(data)
+        if action:
+            await action(event, user_id)
+        
+        elif data.startswith(b"c:"):
+            # Category selection
+            category_name = self._categories[int(data[2:])]["category"]
             
-            await event.answer()
+            if await asyncio.to_thread(self.session_manager.set_category, user_id, category_name):
+                await self.show_subcategory_selection(event, category_name)
+            else:
+                await event.answer("❌ Error selecting category. Please try again.")
+        
+        elif data.startswith(b"s:"):
+            # Subcategory selection
+            category_name, subcategory_name = self._subcat_by_id[int(data[2:])]
             
-        except Exception as e:
-            send_logs(f"Error handling callback query: {e}", 'error')
-            await event.answer("❌ An error occurred. Please try again.")
+            if await asyncio.to_thread(self.session_manager.set_subcategory, user_id, subcategory_name):
+                await self.request_product_name(event, category_name, subcategory_name)
+            else:
+                await event.answer("❌ Error selecting subcategory. Please try again.")
+        
+        await event.answer()
+    
+    async def _on_back_to_categories(self, event, user_id: int):
+        """Go back to category selection"""
+        if self.session_manager.get_session_state(user_id):
+            await asyncio.to_thread(
+                self.session_manager.update_session_state, user_id, ConversationState.CATEGORY_SELECTION
+            )
+            await self.show_category_selection(event)
+    
+    async def _on_confirm_product(self, event, user_id: int):
+        """User confirmed the extracted product data, now ask for price"""
+        await self.request_price(event, user_id, self.session_manager.get_session_state(user_id))
+    
+    async def _on_reject_product(self, event, user_id: int):
+        """User rejected the extracted data, ask for product name again"""
+        session = self.session_manager.get_session_state(user_id)
+        if session:
+            await asyncio.to_thread(
+                self.session_manager.update_session_state, user_id, ConversationState.PRODUCT_INPUT
+            )
+            await self._edit(
+                event,
+                self._PRODUCT_RETRY_TMPL.format(
+                    category=session['category'], subcategory=session['subcategory']
+                ),
+                buttons=self._CANCEL_KB
+            )
     
     async def request_product_name(self, event, category_name: str, subcategory_name: str):
         """Request product name from user"""
         try:
-            await event.edit(
-                f"📁 **Category:** {category_name}\n"
-                f"📂 **Subcategory:** {subcategory_name}\n\n"
-                f"🏷️ Please enter the product name/model:\n"
-                f"*(Be as specific as possible, e.g., \"iPhone 13 Pro Max 256GB\")*",
-                buttons=[[Button.inline("❌ Cancel", "cancel_listing")]],
-                parse_mode="Markdown"
+            await self._edit(
+                event,
+                self._PRODUCT_INPUT_TMPL.format(category=category_name, subcategory=subcategory_name),
+                buttons=self._CANCEL_KB
             )
             
         except Exception as e:
-            send_logs(f"Error requesting product name: {e}", 'error')
+            send_logs("Error requesting product name: %s", 'error', e, exc_info=True)
     
+    @_handler("Error handling text message: %s", "❌ An error occurred processing your message.")
     async def handle_text_message(self, event):
         """Handle text messages based on current session state"""
+        # Cheap checks first: most text the bot sees comes from users without a session
+        user_id = event.sender_id
+        session = self.session_manager.get_session_state(user_id)
+        if not session:
+            return  # No active session, ignore text message
+        
+        handler = self._text_dispatch.get(session.get('state'))
+        if handler:
+            await handler(event, user_id, session, event.raw_text.strip())
+    
+    async def _queue_product_name(self, event, user_id: int, session: Dict, text: str):
+        """Debounce product-name messages so a name typed in several quick messages is analyzed once"""
+        parts, task = self._pending_product.get(user_id, ([], None))
+        if task:
+            task.cancel()
+        parts.append(text)
+        task = asyncio.create_task(self._flush_product_name(event, user_id, session))
+        self._pending_product[user_id] = (parts, task)
+    
+    @_handler("Error processing product name: %s", "❌ An error occurred processing your message.")
+    async def _flush_product_name(self, event, user_id: int, session: Dict):
+        """Wait for the user to stop typing, then process the joined product name"""
+        await asyncio.sleep(_PRODUCT_DEBOUNCE_SECONDS)
+        parts, _ = self._pending_product.pop(user_id, ([], None))
+        if not parts:
+            return
+        # Nothing else references this task once it leaves _pending_product
+        task = asyncio.current_task()
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_tasks.discard)
+        # One extraction per user at a time; the AI client bounds global concurrency
+        if user_id in self._extracting:
+            await self._respond(event, self._BUSY_MSG)
+            return
+        self._extracting.add(user_id)
         try:
-            sender = await event.get_sender()
-            user_id = sender.id
-            message_text = event.text.strip()
-            
-            session = self.session_manager.get_session_state(user_id)
-            if not session:
-                return  # No active session, ignore text message
-            
-            state = session.get('state')
-            
-            if state == ConversationState.PRODUCT_INPUT.value:
-                await self.process_product_name(event, user_id, message_text)
-            
-            elif state == ConversationState.PRICE_INPUT.value:
-                await self.process_price_input(event, user_id, message_text)
-            
-            elif state == ConversationState.PRICE_INPUT.value:
-                await self.process_price_input(event, user_id, message_text)
-                
-        except Exception as e:
-            send_logs(f"Error handling text message: {e}", 'error')
-            await event.respond("❌ An error occurred processing your message.")
+            await self.process_product_name(event, user_id, session, " ".join(parts))
+        finally:
+            self._extracting.discard(user_id)
     
-    async def process_product_name(self, event, user_id: int, product_name: str):
+    def _cancel_pending_product(self, user_id: int):
+        """Drop buffered product-name messages that haven't been processed yet"""
+        pending = self._pending_product.pop(user_id, None)
+        if pending:
+            pending[1].cancel()
+    
+    async def process_product_name(self, event, user_id: int, session: Dict, product_name: str):
         """Process the product name and extract attributes"""
         try:
-            session = self.session_manager.get_session_state(user_id)
-            if not session:
-                await event.respond("❌ Session not found. Please start over with /plaseaza_anunt")
-                return
-            
             # Validate product name
-            if len(product_name.strip()) < 3:
-                await event.respond("❌ Product name too short. Please enter a more detailed product name.")
+            if len(product_name) < 3:
+                await self._respond(event, "❌ Product name too short. Please enter a more detailed product name.")
                 return
             
             # Set product name and update state
-            if not self.session_manager.set_product_name(user_id, product_name):
-                await event.respond("❌ Error saving product name. Please try again.")
+            if not await asyncio.to_thread(self.session_manager.set_product_name, user_id, product_name):
+                await self._respond(event, "❌ Error saving product name. Please try again.")
                 return
             
-            # Show processing message
-            processing_message = await event.respond(
-                f"🔍 **Analyzing product...**\n\n"
-                f"📁 Category: {session['category']}\n"
-                f"📂 Subcategory: {session['subcategory']}\n"
-                f"🏷️ Product: {product_name}\n\n"
-                f"⏳ Please wait while I extract product information...",
-                parse_mode="Markdown"
-            )
-            
             # Get expected attributes
             expected_attributes = self.session_manager.get_expected_attributes(
                 session['category'], session['subcategory']
             )
             
-            # Extract product attributes using AI service
-            extracted_data = await self.deepseek_api.extract_product_attributes(
-                product_name=product_name,
-                category=session['category'],
-                subcategory=session['subcategory'],
-                expected_attributes=expected_attributes
+            # Show processing message and extract product attributes using AI service;
+            # the two round-trips are independent, so run them concurrently
+            processing_message, extracted_data = await asyncio.gather(
+                self._respond(
+                    event,
+                    self._PROCESSING_TMPL.format(
+                        category=session['category'], subcategory=session['subcategory'], product=product_name
+                    )
+                ),
+                self.deepseek_api.extract_product_attributes(
+                    product_name=product_name,
+                    category=session['category'],
+                    subcategory=session['subcategory'],
+                    expected_attributes=expected_attributes
+                )
             )
             
             # Save extracted data to session
-            if self.session_manager.set_extracted_data(user_id, extracted_data):
+            if await asyncio.to_thread(self.session_manager.set_extracted_data, user_id, extracted_data):
                 await self.show_product_confirmation(processing_message, extracted_data)
             else:
-                await processing_message.edit("❌ Error processing product data. Please try again.")
+                await self._edit(processing_message, "❌ Error processing product data. Please try again.")
                 
         except Exception as e:
-            send_logs(f"Error processing product name: {e}", 'error')
-            await event.respond("❌ Error analyzing product. Please try again.")
+            send_logs("Error processing product name: %s", 'error', e, exc_info=True)
+            await self._respond(event, "❌ Error analyzing product. Please try again.")
     
     async def show_product_confirmation(self, message, extracted_data: Dict):
         """Show extracted product data with complete listing for user confirmation"""
         try:
             if not extracted_data.get('success'):
-                await message.edit(
+                await self._edit(
+                    message,
                     f"❌ **Unable to extract product information**\n\n"
                     f"Error: {extracted_data.get('error', 'Unknown error')}\n\n"
                     f"Please try entering a more specific product name.",
-                    buttons=[[Button.inline("❌ Cancel", "cancel_listing")]],
-                    parse_mode="Markdown"
+                    buttons=self._CANCEL_KB
                 )
                 return
 
-            attributes = extracted_data.get('attributes', {})
-            confidence = extracted_data.get('confidence', 0)
-            listing = extracted_data.get('listing', {})
-            price_suggestion = extracted_data.get('price_suggestion', {})
+            # Missing and null sections both fall back to empty
+            attributes = extracted_data.get('attributes') or {}
+            confidence = extracted_data.get('confidence') or 0
+            listing = extracted_data.get('listing') or {}
+            price_suggestion = extracted_data.get('price_suggestion') or {}
             
             # Format attributes for display
-            attr_text = ""
-            for key, value in attributes.items():
-                if value and value != 'Unknown' and value != '_Not found_':
-                    attr_text += f"• **{key}:** {value}\n"
-                else:
-                    attr_text += f"• **{key}:** _Not found_\n"
+            attr_text = "".join([
+                f"• **{key}:** {value if value and value != 'Unknown' else '_Not found_'}\n"
+                for key, value in attributes.items()
+            ])
 
-            confidence_emoji = "🟢" if confidence >= 0.7 else "🟡" if confidence >= 0.4 else "🔴"
+            confidence_emoji = _CONF_EMOJI[(confidence >= 0.4) + (confidence >= 0.7)]
             
             # Format price suggestion
             price_text = ""
-            if price_suggestion and price_suggestion.get('max_price', 0) > 0:
-                price_text = (f"� **Suggested Price:** ${price_suggestion['min_price']:.0f} - "
-                            f"${price_suggestion['max_price']:.0f}\n"
-                            f"_{price_suggestion.get('reasoning', '')}_\n\n")
+            price_range = _price_range(price_suggestion)
+            if price_range:
+                price_text = (f"� **Suggested Price:** {price_range}\n"
+                            f"_{price_suggestion.get('reasoning') or ''}_\n\n")
             
             # Complete listing display (description removed)
-            message_text = (
-                f"🎯 **Complete Listing Generated**\n\n"
-                f"📝 **Title:** {listing.get('title', 'No title generated')}\n\n"
-                f" **Product Details:**\n"
-                f"🏷️ **Product:** {extracted_data['product_name']}\n"
-                f"📁 **Category:** {extracted_data['category']}\n"
-                f"📂 **Subcategory:** {extracted_data['subcategory']}\n"
-                f"{confidence_emoji} **Confidence:** {confidence * 100:.0f}%\n\n"
-                f"{price_text}"
-                f"� **Attributes:**\n{attr_text}\n"
-                f"Is this listing information correct?"
+            message_text = self._CONFIRMATION_TMPL.format(
+                title=listing.get('title') or 'No title generated',
+                product=extracted_data['product_name'],
+                category=extracted_data['category'],
+                subcategory=extracted_data['subcategory'],
+                confidence_emoji=confidence_emoji,
+                confidence=confidence * 100,
+                price_text=price_text,
+                attr_text=attr_text
             )
 
-            await message.edit(
+            await self._edit(
+                message,
                 message_text,
-                buttons=[
-                    [
-                        Button.inline("✅ Yes, Continue", "confirm_product"),
-                        Button.inline("❌ No, Try Again", "reject_product")
-                    ],
-                    [Button.inline("🚫 Cancel Listing", "cancel_listing")]
-                ],
-                parse_mode="Markdown"
+                buttons=self._CONFIRM_KB
             )
 
         except Exception as e:
-            send_logs(f"Error showing product confirmation: {e}", 'error')
-            await message.edit("❌ Error displaying product information.")
+            send_logs("Error showing product confirmation: %s", 'error', e, exc_info=True)
+            await self._edit(message, "❌ Error displaying product information.")
     
-    async def request_price(self, event, user_id: int):
+    async def request_price(self, event, user_id: int, session: Optional[Dict]):
         """Request price input from user"""
         try:
-            session = self.session_manager.get_session_state(user_id)
             if not session or not session.get('extracted_data'):
                 await event.answer("❌ Session error. Please start over.")
                 return
 
             # Update session state
-            self.session_manager.update_session_state(user_id, ConversationState.PRICE_INPUT)
+            await asyncio.to_thread(
+                self.session_manager.update_session_state, user_id, ConversationState.PRICE_INPUT
+            )
 
             # Get extracted data which now includes price suggestion
             extracted_data = session['extracted_data']
             price_suggestion = extracted_data.get('price_suggestion', {})
             
             suggestion_text = ""
-            if price_suggestion and price_suggestion.get('max_price', 0) > 0:
+            price_range = _price_range(price_suggestion)
+            if price_range:
                 suggestion_text = (
-                    f"\n💡 **Suggested Price Range:** "
-                    f"${price_suggestion['min_price']:.0f} - ${price_suggestion['max_price']:.0f}\n"
-                    f"_{price_suggestion.get('reasoning', '')}_\n"
+                    f"\n💡 **Suggested Price Range:** {price_range}\n"
+                    f"_{price_suggestion.get('reasoning') or ''}_\n"
                 )
 
-            await event.edit(
+            await self._edit(
+                event,
                 f"💰 **Set Your Price**\n\n"
                 f"🏷️ Product: {extracted_data['product_name']}\n"
                 f"{suggestion_text}\n"
                 f"Please enter your asking price (numbers only, e.g., 299.99):",
-                buttons=[[Button.inline("❌ Cancel", "cancel_listing")]],
-                parse_mode="Markdown"
+                buttons=self._CANCEL_KB
             )
             
         except Exception as e:
-            send_logs(f"Error requesting price: {e}", 'error')
+            send_logs("Error requesting price: %s", 'error', e, exc_info=True)
             await event.answer("❌ Error requesting price.")
     
     # Description step removed - methods deleted
     
-    async def process_price_input(self, event, user_id: int, price_text: str):
+    async def process_price_input(self, event, user_id: int, session: Dict, price_text: str):
         """Process price input and complete the listing"""
         try:
             # Validate price format
-            price_match = re.search(r'[\d.,]+', price_text.replace(',', '.'))
+            if not any(c.isdigit() for c in price_text):
+                price_match = None
+            else:
+                price_match = _PRICE_RE.search(price_text)
             if not price_match:
-                await event.respond(
+                await self._respond(
+                    event,
                     "❌ Invalid price format. Please enter a number (e.g., 299.99 or 150)."
                 )
                 return
             
             try:
+                # Decimal comma -> point, on the matched number only
                 price = float(price_match.group().replace(',', '.'))
                 if price <= 0 or price > 1000000:
-                    await event.respond("❌ Price must be between 0.01 and 1,000,000.")
+                    await self._respond(event, "❌ Price must be between 0.01 and 1,000,000.")
                     return
             except ValueError:
-                await event.respond("❌ Invalid price. Please enter a valid number.")
+                await self._respond(event, "❌ Invalid price. Please enter a valid number.")
                 return
             
-            # Get user info
-            sender = await event.get_sender()
-            username = sender.username or f"User_{sender.id}"
-            
-            # Get extracted data BEFORE completing listing (since complete_listing clears session)
-            session = self.session_manager.get_session_state(user_id) or {}
-            extracted_data = session.get('extracted_data', {})
-            
-            # Complete the listing
-            product_id = self.session_manager.complete_listing(user_id, username, price)
+            # A repeated price while the first one is still being saved would create a duplicate
+            if user_id in self._saving:
+                return
+            self._saving.add(user_id)
+            # Acknowledge right away; the storage write runs off the event loop meanwhile
+            ack = asyncio.create_task(self._respond(event, self._SAVING_MSG))
+            try:
+                # Get user info
+                _, username = await self.get_user_info(event)
+                
+                # complete_listing clears the session; extracted_data comes from our copy of it
+                extracted_data = session.get('extracted_data') or {}
+                
+                # Complete the listing
+                product_id = await asyncio.to_thread(
+                    self.session_manager.complete_listing, user_id, username, price, session
+                )
+            except BaseException:
+                # Don't leave the acknowledgement running (or its error unretrieved) past the failure
+                ack.cancel()
+                await asyncio.gather(ack, return_exceptions=True)
+                raise
+            finally:
+                self._saving.discard(user_id)
+            
+            # The save has finished either way; a lost acknowledgement isn't a failed save
+            try:
+                ack_message = await ack
+            except Exception as e:
+                send_logs("Error sending saving acknowledgement: %s", 'warning', e)
+                ack_message = None
             
             if product_id:
                 # Add final price to extracted data for export
                 extracted_data['final_price'] = price
                 
-                # Export to JSON file
-                try:
-                    json_filepath = self.exporter.export_listing(extracted_data, user_id, product_id)
-                    send_logs(f"Listing exported to JSON: {json_filepath}", 'info')
-                except Exception as export_error:
-                    send_logs(f"Error exporting to JSON: {export_error}", 'error')
-                    json_filepath = None
+                # Export to JSON file in the background; the worker reports the filename
+                self._queue_export(extracted_data, user_id, product_id, event)
                 
                 # Get listing information and attributes
                 listing = extracted_data.get('listing', {})
                 attributes = extracted_data.get('attributes', {})
                 
                 # Format attributes for display
-                attr_text = ""
-                for key, value in attributes.items():
-                    if value and value != 'Unknown' and value != '_Not found_':
-                        attr_text += f"• **{key}:** {value}\n"
+                attr_text = "".join([
+                    f"• **{key}:** {value}\n"
+                    for key, value in attributes.items()
+                    if value and value not in _MISSING_ATTR_VALUES
+                ])
                 
                 # Show complete listing information
-                message_text = (
-                    f"🎉 **Listing Created Successfully!**\n\n"
-                    f"🆔 **Listing ID:** #{product_id}\n\n"
-                    f"📝 **Your Listing:**\n"
-                    f"**Title:** {listing.get('title', extracted_data.get('product_name', 'Unknown'))}\n\n"
-                    # Description removed from listing display
-                    f"📊 **Details:**\n"
-                    f"🏷️ **Product:** {extracted_data.get('product_name', 'Unknown')}\n"
-                    f"📁 **Category:** {extracted_data.get('category', 'Unknown')}\n"
-                    f"📂 **Subcategory:** {extracted_data.get('subcategory', 'Unknown')}\n"
-                    f"💰 **Price:** ${price:.2f}\n\n"
-                    f"🔧 **Product Attributes:**\n{attr_text if attr_text else 'No attributes extracted'}\n"
-                    f"✅ **Saved to database!**\n"
+                product_name = extracted_data.get('product_name', 'Unknown')
+                message_text = self._LISTING_CREATED_TMPL.format(
+                    product_id=product_id,
+                    title=listing.get('title', product_name),
+                    product=product_name,
+                    category=extracted_data.get('category', 'Unknown'),
+                    subcategory=extracted_data.get('subcategory', 'Unknown'),
+                    price=price,
+                    attr_text=attr_text or 'No attributes extracted'
                 )
-                
-                if json_filepath:
-                    message_text += f"📄 **Exported to JSON:** {json_filepath.split('/')[-1]}"
-                
-                await event.respond(message_text, parse_mode="Markdown")
             else:
-                await event.respond("❌ Failed to save listing. Please try again.")
+                message_text = "❌ Failed to save listing. Please try again."
+            
+            if ack_message is not None:
+                await self._edit(ack_message, message_text)
+            else:
+                await self._respond(event, message_text)
                 
         except Exception as e:
-            send_logs(f"Error processing price input: {e}", 'error')
-            await event.respond("❌ Error processing price. Please try again.")
+            send_logs("Error processing price input: %s", 'error', e, exc_info=True)
+            await self._respond(event, "❌ Error processing price. Please try again.")
+    
+    def _queue_export(self, extracted_data: Dict, user_id: int, product_id: int, event):
+        """Hand a completed listing to the export worker, starting it if needed"""
+        if self._export_worker is None or self._export_worker.done():
+            self._export_worker = asyncio.create_task(self._export_loop())
+        self._export_queue.put_nowait((extracted_data, user_id, product_id, event))
+    
+    def _export_batch(self, batch: List[Tuple]) -> List:
+        """Write a batch of exports (runs in a worker thread); returns a path or the error per item"""
+        results = []
+        for extracted_data, user_id, product_id, _ in batch:
+            try:
+                results.append(self.exporter.export_listing(extracted_data, user_id, product_id))
+            except Exception as e:
+                results.append(e)
+        return results
+    
+    async def _export_loop(self):
+        """Drain the export queue, writing whatever has piled up in a single thread trip"""
+        while True:
+            batch = [await self._export_queue.get()]
+            while len(batch) < _EXPORT_BATCH_MAX and not self._export_queue.empty():
+                batch.append(self._export_queue.get_nowait())
+            
+            try:
+                results = await asyncio.to_thread(self._export_batch, batch)
+                replies = []
+                for (_, _, _, event), result in zip(batch, results):
+                    if isinstance(result, Exception):
+                        send_logs("Error exporting to JSON: %s", 'error', result, exc_info=result)
+                    else:
+                        send_logs("Listing exported to JSON: %s", 'info', result)
+                        replies.append(
+                            self._respond(event, f"📄 **Exported to JSON:** {os.path.basename(result)}")
+                        )
+                await asyncio.gather(*replies, return_exceptions=True)
+            except Exception as e:
+                send_logs("Error in export worker: %s", 'error', e, exc_info=True)
+            finally:
+                for _ in batch:
+                    self._export_queue.task_done()
+    
+    async def close(self):
+        """Write every queued export, then stop the export worker (call on shutdown)"""
+        if not self._export_queue.empty() and (self._export_worker is None or self._export_worker.done()):
+            self._export_worker = asyncio.create_task(self._export_loop())
+        await self._export_queue.join()
+        if self._export_worker is not None:
+            self._export_worker.cancel()
+            await asyncio.gather(self._export_worker, return_exceptions=True)
+            self._export_worker = None
     
     async def cancel_listing(self, event, user_id: int, use_edit: bool = True):
         """Cancel current listing session"""
         try:
-            if self.session_manager.cancel_listing(user_id):
-                message_text = (
-                    "🚫 **Listing Cancelled**\n\n"
-                    "Your listing session has been cancelled. "
-                    "You can start a new one anytime with /plaseaza_anunt."
-                )
+            self._cancel_pending_product(user_id)
+            if await asyncio.to_thread(self.session_manager.cancel_listing, user_id):
+                message_text = self._CANCELLED_MSG
                 
                 if use_edit:
-                    await event.edit(
+                    await self._edit(
+                        event,
                         message_text,
-                        buttons=None,
-                        parse_mode="Markdown"
+                        buttons=None
                     )
                 else:
-                    await event.respond(
-                        message_text,
-                        parse_mode="Markdown"
+                    await self._respond(
+                        event,
+                        message_text
                     )
             else:
                 if use_edit:
                     await event.answer("❌ Error cancelling listing.")
                 else:
-                    await event.respond("❌ Error cancelling listing.")
+                    await self._respond(event, "❌ Error cancelling listing.")
                 
         except Exception as e:
-            send_logs(f"Error cancelling listing: {e}", 'error')
+            send_logs("Error cancelling listing: %s", 'error', e, exc_info=True)
             if not use_edit:
-                await event.respond("❌ Error cancelling listing.")
+                await self._respond(event, "❌ Error cancelling listing.")
     
+    @_handler("Error handling cancel command: %s", "❌ Error processing cancel command.")
     async def handle_cancel_command(self, event):
         """Handle /cancel command"""
-        try:
-            sender = await event.get_sender()
-            user_id = sender.id
-            
-            if self.session_manager.is_session_active(user_id):
-                await self.cancel_listing(event, user_id, use_edit=False)
-            else:
-                await event.respond("ℹ️ No active listing session to cancel.")
-                
-        except Exception as e:
-            send_logs(f"Error handling cancel command: {e}", 'error')
-            await event.respond("❌ Error processing cancel command.")
+        user_id = event.sender_id
+        
+        if self.session_manager.is_session_active(user_id):
+            await self.cancel_listing(event, user_id, use_edit=False)
+        else:
+            await self._respond(event, self._NO_SESSION_TO_CANCEL_MSG)
     
+    @_handler("Error handling status command: %s", "❌ Error getting status.")
     async def handle_status_command(self, event):
         """Handle /status command"""
-        try:
-            sender = await event.get_sender()
-            user_id = sender.id
-            
-            summary = self.session_manager.get_session_summary(user_id)
-            if summary:
-                await event.respond(summary, parse_mode="Markdown")
-            else:
-                await event.respond("ℹ️ No active listing session. Use /plaseaza_anunt to start one!")
-                
-        except Exception as e:
-            send_logs(f"Error handling status command: {e}", 'error')
-            await event.respond("❌ Error getting status.")
+        user_id = event.sender_id
+        
+        summary = self.session_manager.get_session_summary(user_id)
+        if summary:
+            await self._respond(event, summary)
+        else:
+            await self._respond(event, self._NO_ACTIVE_SESSION_MSG)
     
+    @_handler("Error handling my_listings command: %s", "❌ Error retrieving your listings.")
     async def handle_my_listings_command(self, event):
         """Handle /my_listings command"""
-        try:
-            sender = await event.get_sender()
-            user_id = sender.id
-            
-            products = self.storage.get_user_products(user_id, limit=5)
-            
-            if not products:
-                await event.respond("📭 You haven't created any listings yet!")
-                return
-            
-            listings_text = "📋 **Your Recent Listings:**\n\n"
-            
-            for product in products:
-                status_emoji = "🟢" if product['status'] == 'active' else "🔴"
-                listings_text += (
-                    f"{status_emoji} **#{product['id']}** - {product['product_name']}\n"
-                    f"💰 ${product['price']:.2f} | 📁 {product['category']}\n"
-                    f"📅 {product['created_at'][:10]}\n\n"
-                )
-            
-            await event.respond(listings_text, parse_mode="Markdown")
-            
-        except Exception as e:
-            send_logs(f"Error handling my_listings command: {e}", 'error')
-            await event.respond("❌ Error retrieving your listings.")
\ No newline at end of file
+        user_id = event.sender_id
+        
+        # Directory scan + file reads; keep them off the event loop
+        rows = await asyncio.to_thread(self.storage.get_user_products_summary, user_id, 5)
+        
+        if not rows:
+            await self._respond(event, "📭 You haven't created any listings yet!")
+            return
+        
+        listings_text = "📋 **Your Recent Listings:**\n\n" + "".join([
+            f"{'🟢' if row.status == 'active' else '🔴'} **#{row.id}** - {row.product_name}\n"
+            f"💰 ${row.price:.2f} | 📁 {row.category}\n"
+            f"📅 {row.created_date}\n\n"
+            for row in rows
+        ])
+        
+        await self._respond(event, listings_text)
\ No newline at end of file
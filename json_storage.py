@@ -1,17 +1,81 @@
-import json
+import atexit
+import copy
+import orjson
 import os
 import logging
-from logs import send_logs
+from logs import send_logs, log_enabled
 from datetime import datetime
-from typing import Dict, List, Optional, Any
+from itertools import islice
+from typing import Dict, List, NamedTuple, Optional, Any, Tuple
 import threading
 
+# orjson encodes straight to UTF-8 bytes in one call, several times faster than json.dump;
+# files stay indented and, like json, int dict keys are written as strings
+_DUMPS_OPTIONS = orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS
+
+# Default for dict lookups where None is a legitimate value
+_ABSENT = object()
+
+def _dumps(data) -> bytes:
+    return orjson.dumps(data, option=_DUMPS_OPTIONS)
+
+def _load_file(path: str):
+    with open(path, 'rb') as f:
+        return orjson.loads(f.read())
+
+def _write_file_atomic(path: str, encoded: bytes):
+    """Write to a temp file and rename it over path, so a crash never leaves a half-written file"""
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(encoded)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+class ListingSummary(NamedTuple):
+    """The listing fields /my_listings shows, read by name instead of by position"""
+    id: int
+    product_name: str
+    price: float
+    category: str
+    created_date: str
+    status: str
+
 class JSONStorage:
-    def __init__(self, users_file="users.json", listings_dir="listings"):
+    def __init__(self, users_file="users.json", listings_dir="listings", flush_interval: float = 1.0):
         self.users_file = users_file
         self.listings_dir = listings_dir
-        # Lock to protect concurrent access to the users.json file within the process
-        self._lock = threading.Lock()
+        # Session changes are written to users.json at most once per flush_interval seconds
+        # (and on close), so a burst of updates costs one encode + write instead of one each
+        self.flush_interval = flush_interval
+        self._flush_timer: Optional[threading.Timer] = None
+        # The flush timer is a daemon thread that dies at interpreter exit; write pending changes then
+        atexit.register(self.flush)
+        # Lock to protect concurrent access to the users.json file within the process.
+        # Re-entrant so read-modify-write updates can hold it across load + save.
+        self._lock = threading.RLock()
+        # In-memory copy of users.json: reads are served from here, changes are flushed to disk
+        self._users_cache: Optional[Dict] = None
+        # users.json is replaced atomically; where that's impossible (e.g. it is bind-mounted as
+        # a single file) it is rewritten in place through one long-lived handle instead.
+        # File I/O has its own lock so readers of the cache never wait on a disk write;
+        # snapshots are versioned so a slower, older write can't overwrite a newer one.
+        self._replace_users = True
+        self._users_fp = None
+        self._file_lock = threading.Lock()
+        self._users_version = 0
+        self._written_version = 0
+        # user_id -> that user's listing ids in ascending (creation) order; built the first time
+        # it's needed and persisted to index_file, so a restart only opens listings it hasn't seen
+        self._listings_by_user: Optional[Dict[int, List[int]]] = None
+        self._index_lock = threading.Lock()
+        self._index_dirty = False
+        self.index_file = os.path.join(listings_dir, "index.json")
         self.init_storage()
     
     def init_storage(self):
@@ -27,32 +91,98 @@ class JSONStorage:
                     "sessions": {},
                     "logs": []
                 }
-                with open(self.users_file, 'w') as f:
-                    json.dump(initial_data, f, indent=2)
+                with open(self.users_file, 'wb') as f:
+                    f.write(_dumps(initial_data))
             
             send_logs("JSON storage initialized successfully", 'info')
             
         except Exception as e:
             send_logs(f"Error initializing JSON storage: {e}", 'error')
     
+    def _users_handle(self):
+        """Long-lived read/write handle on users.json (caller holds the file lock)"""
+        if self._users_fp is None or self._users_fp.closed:
+            self._users_fp = open(self.users_file, 'r+b')
+        return self._users_fp
+    
+    def close(self):
+        """Flush pending session changes, release the users.json handle and persist the listing index"""
+        self.flush()
+        with self._file_lock:
+            if self._users_fp is not None:
+                self._users_fp.close()
+                self._users_fp = None
+        with self._index_lock:
+            if self._index_dirty:
+                self._save_listing_index()
+    
     def _load_users_data(self) -> Dict:
         """Load users data from JSON file"""
         try:
             # Protect file read with a lock to avoid concurrent partial reads/writes
             with self._lock:
-                with open(self.users_file, 'r') as f:
-                    return json.load(f)
+                if self._users_cache is None:
+                    with self._file_lock:
+                        self._users_cache = _load_file(self.users_file)
+                return self._users_cache
         except Exception as e:
             send_logs(f"Error loading users data: {e}", 'error')
             return {"sessions": {}, "logs": []}
     
+    def _mark_users_dirty(self, data: Dict):
+        """Make data the current users state and schedule a flush (caller holds the lock)"""
+        self._users_cache = data
+        self._users_version += 1
+        if self._flush_timer is None:
+            self._flush_timer = threading.Timer(self.flush_interval, self.flush)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+    
+    def flush(self):
+        """Write pending session changes to users.json now"""
+        try:
+            with self._lock:
+                if self._flush_timer is not None:
+                    self._flush_timer.cancel()
+                    self._flush_timer = None
+                if self._users_version <= self._written_version:
+                    return
+                # Compact: users.json is machine state, rewritten on every flush
+                snapshot = (self._users_version, orjson.dumps(self._users_cache, option=orjson.OPT_NON_STR_KEYS))
+            self._write_users_snapshot(snapshot)
+        except Exception as e:
+            send_logs(f"Error flushing users data: {e}", 'error')
+    
+    def _write_users_snapshot(self, snapshot: Tuple[int, bytes]):
+        """Write an encoded snapshot to users.json unless a newer one is already there.
+        
+        Called without the cache lock held, so session reads carry on during the write.
+        """
+        version, encoded = snapshot
+        with self._file_lock:
+            if version <= self._written_version:
+                return
+            if self._replace_users:
+                try:
+                    _write_file_atomic(self.users_file, encoded)
+                    self._written_version = version
+                    return
+                except OSError as e:
+                    send_logs("Can't replace %s atomically (%s); rewriting it in place from now on",
+                              'warning', self.users_file, e)
+                    self._replace_users = False
+            f = self._users_handle()
+            f.seek(0)
+            f.write(encoded)
+            f.truncate()
+            f.flush()
+            self._written_version = version
+    
     def _save_users_data(self, data: Dict):
         """Save users data to JSON file"""
         try:
-            # Protect file write with a lock to avoid concurrent writes corrupting the file
             with self._lock:
-                with open(self.users_file, 'w') as f:
-                    json.dump(data, f, indent=2)
+                self._mark_users_dirty(data)
         except Exception as e:
             send_logs(f"Error saving users data: {e}", 'error')
     
@@ -80,8 +210,12 @@ class JSONStorage:
             
             # Save to listings directory
             listing_file = os.path.join(self.listings_dir, f"listing_{product_id}.json")
-            with open(listing_file, 'w') as f:
-                json.dump(product_data, f, indent=2)
+            _write_file_atomic(listing_file, _dumps(product_data))
+            
+            with self._index_lock:
+                if self._listings_by_user is not None:
+                    self._listings_by_user.setdefault(user_id, []).append(product_id)
+                    self._index_dirty = True
             
             send_logs(f"Product saved successfully with ID: {product_id}", 'info')
             return product_id
@@ -93,18 +227,20 @@ class JSONStorage:
     def get_user_session(self, user_id: int) -> Optional[Dict]:
         """Get current user session state"""
         try:
-            data = self._load_users_data()
-            user_id_str = str(user_id)
-            
-            if user_id_str in data["sessions"]:
-                session = data["sessions"][user_id_str]
-                # Convert extracted_data back from string if needed
-                if "extracted_data" in session and isinstance(session["extracted_data"], str):
-                    try:
-                        session["extracted_data"] = json.loads(session["extracted_data"])
-                    except:
-                        session["extracted_data"] = None
-                return session
+            with self._lock:
+                data = self._load_users_data()
+                user_id_str = str(user_id)
+                
+                if user_id_str in data["sessions"]:
+                    # Hand out a copy so callers can't mutate the cached session
+                    session = copy.deepcopy(data["sessions"][user_id_str])
+                    # Convert extracted_data back from string if needed
+                    if "extracted_data" in session and isinstance(session["extracted_data"], str):
+                        try:
+                            session["extracted_data"] = orjson.loads(session["extracted_data"])
+                        except:
+                            session["extracted_data"] = None
+                    return session
             
             return None
             
@@ -112,35 +248,42 @@ class JSONStorage:
             send_logs(f"Error getting user session: {e}", 'error')
             return None
     
+    def get_user_state(self, user_id: int) -> Optional[str]:
+        """Get just the state of a user's session, without copying the session"""
+        try:
+            with self._lock:
+                session = self._load_users_data()["sessions"].get(str(user_id))
+                return session.get("state") if session is not None else None
+        except Exception as e:
+            send_logs(f"Error getting user state: {e}", 'error')
+            return None
+    
     def update_user_session(self, user_id: int, state: str = None, category: str = None, 
                           subcategory: str = None, product_name: str = None, 
                           extracted_data: Dict = None):
         """Update or create user session"""
         try:
-            data = self._load_users_data()
-            user_id_str = str(user_id)
-            
-            # Get existing session or create new one
-            if user_id_str not in data["sessions"]:
-                data["sessions"][user_id_str] = {}
-            
-            session = data["sessions"][user_id_str]
-            
-            # Update fields if provided
-            if state is not None:
-                session["state"] = state
-            if category is not None:
-                session["category"] = category
-            if subcategory is not None:
-                session["subcategory"] = subcategory
-            if product_name is not None:
-                session["product_name"] = product_name
-            if extracted_data is not None:
-                session["extracted_data"] = extracted_data
-            
-            session["updated_at"] = datetime.now().isoformat()
-            
-            self._save_users_data(data)
+            with self._lock:
+                data = self._load_users_data()
+
+                # Get existing session or create new one in a single dict lookup
+                session = data["sessions"].setdefault(str(user_id), {})
+                
+                # Update fields if provided
+                if state is not None:
+                    session["state"] = state
+                if category is not None:
+                    session["category"] = category
+                if subcategory is not None:
+                    session["subcategory"] = subcategory
+                if product_name is not None:
+                    session["product_name"] = product_name
+                if extracted_data is not None:
+                    session["extracted_data"] = copy.deepcopy(extracted_data)
+                
+                session["updated_at"] = datetime.now().isoformat()
+                
+                self._mark_users_dirty(data)
             
         except Exception as e:
             send_logs(f"Error updating user session: {e}", 'error')
@@ -148,12 +291,14 @@ class JSONStorage:
     def clear_user_session(self, user_id: int):
         """Clear user session after completing the listing"""
         try:
-            data = self._load_users_data()
-            user_id_str = str(user_id)
-            
-            if user_id_str in data["sessions"]:
+            with self._lock:
+                data = self._load_users_data()
+                user_id_str = str(user_id)
+                
+                if user_id_str not in data["sessions"]:
+                    return
                 del data["sessions"][user_id_str]
-                self._save_users_data(data)
+                self._mark_users_dirty(data)
             
         except Exception as e:
             send_logs(f"Error clearing user session: {e}", 'error')
@@ -161,6 +306,10 @@ class JSONStorage:
     def log_user_action(self, user_id: int, action: str, details: Dict = None):
         """Log user actions for analytics and debugging"""
         try:
+            # QueueHandler still formats the record on this thread; only the handler I/O
+            # runs on the listener thread, so skip building it when INFO is filtered out
+            if not log_enabled('info'):
+                return
             log_msg = {
                 "user_id": user_id,
                 "action": action,
@@ -168,50 +317,119 @@ class JSONStorage:
                 "timestamp": datetime.now().isoformat()
             }
             # Emit as INFO so it's captured by existing handlers (file + stdout)
-            send_logs(f"User action: {log_msg}", 'info')
+            send_logs("User action: %s", 'info', log_msg)
         except Exception as e:
             # Logging should never raise; if it does, fallback to error log
             send_logs(f"Error emitting user action log: {e}", 'error')
     
-    def get_user_products(self, user_id: int, limit: int = 10) -> List[Dict]:
-        """Get user's recent products"""
+    def _load_listing_index(self) -> Dict[int, Any]:
+        """Listing id -> owner as last persisted, or empty if there is no usable index file"""
         try:
-            products = []
-            
-            # List all listing files
-            if not os.path.exists(self.listings_dir):
-                return products
-            
-            listing_files = [f for f in os.listdir(self.listings_dir) if f.startswith("listing_") and f.endswith(".json")]
-            
-            # Load and filter user's products
-            for filename in listing_files:
+            return {product_id: owner for product_id, owner in _load_file(self.index_file)}
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            send_logs(f"Error loading listing index, rebuilding it: {e}", 'warning')
+            return {}
+    
+    def _save_listing_index(self):
+        """Persist the listing index as [id, owner] pairs (caller holds the index lock)"""
+        try:
+            pairs = [
+                [product_id, owner]
+                for owner, product_ids in self._listings_by_user.items()
+                for product_id in product_ids
+            ]
+            _write_file_atomic(self.index_file, orjson.dumps(pairs))
+            self._index_dirty = False
+        except Exception as e:
+            send_logs(f"Error saving listing index: {e}", 'error')
+    
+    def _build_listing_index(self) -> Dict[int, List[int]]:
+        """Group listing ids by owner, opening only listings the persisted index doesn't know"""
+        index: Dict[int, List[int]] = {}
+        if not os.path.exists(self.listings_dir):
+            return index
+        
+        # Listing ids are creation timestamps in milliseconds, so sorting them gives creation order
+        listing_ids = []
+        for filename in os.listdir(self.listings_dir):
+            if filename.startswith("listing_") and filename.endswith(".json"):
+                try:
+                    listing_ids.append(int(filename[8:-5]))
+                except ValueError:
+                    continue
+        listing_ids.sort()
+        
+        known = self._load_listing_index()
+        # Listings deleted since the index was written just drop out
+        changed = len(known) != len(listing_ids)
+        for product_id in listing_ids:
+            owner = known.get(product_id, _ABSENT)
+            if owner is _ABSENT:
+                changed = True
                 try:
-                    filepath = os.path.join(self.listings_dir, filename)
-                    with open(filepath, 'r') as f:
-                        product = json.load(f)
-                    
-                    if product.get("user_id") == user_id:
-                        products.append(product)
+                    owner = _load_file(os.path.join(self.listings_dir, f"listing_{product_id}.json")).get("user_id")
                 except Exception as e:
-                    send_logs(f"Error loading listing file {filename}: {e}", 'error')
+                    send_logs(f"Error indexing listing {product_id}: {e}", 'error')
                     continue
-            
-            # Sort by created_at (most recent first) and limit
-            products.sort(key=lambda x: x.get("created_at", ""), reverse=True)
-            return products[:limit]
+            index.setdefault(owner, []).append(product_id)
+        
+        self._listings_by_user = index
+        if changed:
+            self._save_listing_index()
+        return index
+    
+    def _iter_user_products(self, user_id: int):
+        """Yield a user's products newest first, opening only that user's listing files"""
+        with self._index_lock:
+            if self._listings_by_user is None:
+                self._listings_by_user = self._build_listing_index()
+            product_ids = list(self._listings_by_user.get(user_id, ()))
+        
+        for product_id in reversed(product_ids):
+            try:
+                product = _load_file(os.path.join(self.listings_dir, f"listing_{product_id}.json"))
+            except Exception as e:
+                send_logs(f"Error loading listing file listing_{product_id}.json: {e}", 'error')
+                continue
+            yield product
+    
+    def get_user_products(self, user_id: int, limit: int = 10) -> List[Dict]:
+        """Get user's recent products"""
+        try:
+            # Newest first; stop reading files once we have enough
+            return list(islice(self._iter_user_products(user_id), limit))
             
         except Exception as e:
             send_logs(f"Error getting user products: {e}", 'error')
             return []
     
+    def get_user_products_summary(self, user_id: int, limit: int = 10) -> List[ListingSummary]:
+        """Get user's recent products, projected to the fields shown in listing overviews"""
+        try:
+            return [
+                ListingSummary(
+                    id=p["id"],
+                    product_name=p["product_name"],
+                    price=p["price"],
+                    category=p["category"],
+                    created_date=p["created_at"][:10],
+                    status=p["status"]
+                )
+                for p in islice(self._iter_user_products(user_id), limit)
+            ]
+            
+        except Exception as e:
+            send_logs(f"Error getting user products summary: {e}", 'error')
+            return []
+    
     def get_product_by_id(self, product_id: int) -> Optional[Dict]:
         """Get a specific product by ID"""
         try:
             listing_file = os.path.join(self.listings_dir, f"listing_{product_id}.json")
             if os.path.exists(listing_file):
-                with open(listing_file, 'r') as f:
-                    return json.load(f)
+                return _load_file(listing_file)
             return None
             
         except Exception as e:
@@ -223,14 +441,12 @@ class JSONStorage:
         try:
             listing_file = os.path.join(self.listings_dir, f"listing_{product_id}.json")
             if os.path.exists(listing_file):
-                with open(listing_file, 'r') as f:
-                    product = json.load(f)
+                product = _load_file(listing_file)
                 
                 product["status"] = status
                 product["updated_at"] = datetime.now().isoformat()
                 
-                with open(listing_file, 'w') as f:
-                    json.dump(product, f, indent=2)
+                _write_file_atomic(listing_file, _dumps(product))
                 
                 return True
             return False
@@ -1,5 +1,8 @@
+import atexit
 import logging
 import datetime
+import queue
+from logging.handlers import QueueHandler, QueueListener
 import pytz
 time_zone = pytz.timezone('Europe/Chisinau')
 class ColoredFormatter(logging.Formatter):
@@ -48,15 +51,45 @@ if not any(isinstance(h, logging.StreamHandler) for h in root_logger.handlers):
     root_logger.addHandler(console_handler)
 root_logger.setLevel(logging.INFO)
 
-def send_logs(message, type):
-    """Centralized logging wrapper. type can be 'info','warning','error','critical'."""
-    if type == 'info':
-        logging.info(message)
+_LEVELS = {
+    'debug': logging.DEBUG,
+    'info': logging.INFO,
+    'warning': logging.WARNING,
+    'error': logging.ERROR,
+    'critical': logging.CRITICAL
+}
+
+def log_enabled(type):
+    """Return True if a message of the given type would actually be emitted."""
+    return root_logger.isEnabledFor(_LEVELS.get(type, logging.INFO))
+
+def send_logs(message, type, *args, **kwargs):
+    """Centralized logging wrapper. type can be 'debug','info','warning','error','critical'.
+    Extra args are %-formatted into message lazily, only if the record is emitted;
+    keyword args such as exc_info=True are passed through to logging."""
+    if type == 'debug':
+        logging.debug(message, *args, **kwargs)
+    elif type == 'info':
+        logging.info(message, *args, **kwargs)
     elif type == 'warning':
-        logging.warning(message)
+        logging.warning(message, *args, **kwargs)
     elif type == 'error':
-        logging.error(message)
+        logging.error(message, *args, **kwargs)
     elif type == 'critical':
-        logging.critical(message)
+        logging.critical(message, *args, **kwargs)
     else:
-        logging.info(message)
\ No newline at end of file
+        logging.info(message, *args, **kwargs)
+
+def enable_queue_logging(*extra_handlers):
+    """Move root handlers (plus extra_handlers) behind a QueueListener thread so
+    log I/O never blocks the asyncio event loop. Returns the started listener."""
+    handlers = [h for h in root_logger.handlers if not isinstance(h, QueueHandler)]
+    handlers.extend(extra_handlers)
+    for handler in list(root_logger.handlers):
+        root_logger.removeHandler(handler)
+    log_queue = queue.SimpleQueue()
+    root_logger.addHandler(QueueHandler(log_queue))
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
\ No newline at end of file
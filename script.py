@@ -6,7 +6,8 @@ import configparser # Library for reading from a configuration file, # pip insta
 import datetime # Library that we will need to get the day and time, # pip install datetime
 import pytz
 import logging
-from logs import send_logs
+import signal
+from logs import send_logs, enable_queue_logging
 
 # Import our custom modules
 from json_storage import JSONStorage
@@ -14,14 +15,11 @@ from ai_api import AIModelClient
 from session_manager import SessionManager
 from bot_handlers import BotHandlers
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('bot.log')
-    ]
-)
+# Configure logging: console + bot.log, written from a background thread
+# (basicConfig would be a no-op here since logs.py already attached a console handler)
+file_handler = logging.FileHandler('bot.log')
+file_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+enable_queue_logging(file_handler)
 
 #### Access credentials
 config = configparser.ConfigParser() # Define the method to read the configuration file
@@ -48,7 +46,7 @@ except Exception as e:
     send_logs(f"AI Model Client initialization failed: {e}", 'error')
     raise
 
-session_manager = SessionManager()
+session_manager = SessionManager(storage=storage)
 bot_handlers = BotHandlers(storage, ai_client, session_manager)
 
 # Create the client and the session called session_master. We start the session as the Bot (using bot_token)
@@ -60,9 +58,7 @@ bot_handlers.register_handlers(client)
 # Define the /start command
 @client.on(events.NewMessage(func=lambda e: e.text and e.text.lower().startswith('/start'))) 
 async def start(event):
-    sender = await event.get_sender()
-    SENDER = sender.id
-    username = sender.username or f"User_{SENDER}"
+    SENDER, username = await bot_handlers.get_user_info(event)
     
     text = f"""
 🤖 **Second-Hand Market Bot**
@@ -92,8 +88,7 @@ Ready to start selling? Use /plaseaza_anunt to begin! 🚀
 # Help command
 @client.on(events.NewMessage(func=lambda e: e.text and e.text.lower().startswith('/help')))
 async def help_command(event):
-    sender = await event.get_sender()
-    SENDER = sender.id
+    SENDER = event.sender_id
     
     help_text = """
 🤖 **Second-Hand Market Bot - Help**
@@ -140,9 +135,22 @@ if __name__ == '__main__':
     
     send_logs(f"Categories loaded: {len(session_manager.get_categories())} categories", 'info')
     
+    # docker stop sends SIGTERM; disconnect so run_until_disconnected returns and the
+    # finally block below flushes storage and closes the AI client
+    try:
+        client.loop.add_signal_handler(signal.SIGTERM, lambda: client.loop.create_task(client.disconnect()))
+    except NotImplementedError:
+        pass  # no loop signal handlers on Windows
+    
     try:
         client.run_until_disconnected()
     except KeyboardInterrupt:
         send_logs("Bot stopped by user", 'info')
     except Exception as e:
         send_logs(f"Fatal error: {e}", 'error')
+    finally:
+        # Write exports still queued for listings saved just before shutdown
+        client.loop.run_until_complete(bot_handlers.close())
+        # Release pooled HTTP connections held by the AI client
+        client.loop.run_until_complete(ai_client.close())
+        storage.close()
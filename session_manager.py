@@ -16,8 +16,9 @@ class ConversationState(Enum):
     COMPLETED = "completed"
 
 class SessionManager:
-    def __init__(self, categories_file="shop_categories.json"):
-        self.storage = JSONStorage()
+    def __init__(self, categories_file="shop_categories.json", storage: Optional[JSONStorage] = None):
+        # Share the caller's storage so there is one users.json cache and file handle
+        self.storage = storage if storage is not None else JSONStorage()
         self.categories = self._load_categories(categories_file)
     
     def _load_categories(self, categories_file: str) -> Dict:
@@ -163,9 +164,12 @@ class SessionManager:
             send_logs(f"Error setting extracted data: {e}", 'error')
             return False
     
-    def complete_listing(self, user_id: int, username: str, price: float) -> Optional[int]:
+    def complete_listing(self, user_id: int, username: str, price: float,
+                         session: Optional[Dict] = None) -> Optional[int]:
         try:
-            session = self.get_session_state(user_id)
+            # Callers that already hold the session can pass it to skip another lookup
+            if session is None:
+                session = self.get_session_state(user_id)
             if not session:
                 send_logs(f"No session found for user {user_id}", 'error')
                 return None
@@ -219,8 +223,9 @@ class SessionManager:
             return False
     
     def is_session_active(self, user_id: int) -> bool:
-        session = self.get_session_state(user_id)
-        return session is not None and session.get('state') != ConversationState.IDLE.value
+        # State-only lookup: called for every stray text message, so skip the session copy
+        state = self.storage.get_user_state(user_id)
+        return state is not None and state != ConversationState.IDLE.value
     
     def get_session_summary(self, user_id: int) -> Optional[str]:
         """Get a human-readable summary of the current session"""